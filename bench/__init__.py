@@ -0,0 +1,11 @@
+'''
+Benchmarks, run from the repository root with `python3 -m bench.<name>`:
+
+    synth     generate synthetic synteny, GFF and hit inputs
+    stages    time and measure memory for each stage of the pipeline
+    load      synteny load time and peak memory against index size
+    overlap   overlap queries on dense, nested synteny tracks
+    dedupe    duplicate hit detection on a gene with many hits
+    synmerger SynMerger one gene at a time against merge_all on a dense genome
+    memory    bytes per synteny block for each interval layout
+'''
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+'''
+Benchmark duplicate detection in HitMerger on one gene with many hits.
+
+Every hit lands in a syntenic region, so all unique hits are kept and each
+duplicate check is made against a growing list. Compares the set lookup now
+used by HitMerger with the old scan over result.hits. Run from the
+repository root:
+
+    python3 -m bench.dedupe --hits 10000
+'''
+
+import argparse
+import random
+import time
+
+import lib.contigs as contigs
+import lib.genome as genome
+import lib.synteny as synteny
+import lib.exonerate as exonerate
+import lib.syn_merger as syn_merger
+import lib.hit_merger as hit_merger
+import lib.result_manager as result_manager
+
+class ListScanHitMerger(hit_merger.HitMerger):
+    '''
+    HitMerger with the old O(h) duplicate check
+    '''
+    def _is_duplicate(self, result, hit):
+        for h in result.hits:
+            if h == hit:
+                return True
+        return False
+
+def make_inputs(nhits, dup_rate, seed=42):
+    rng = random.Random(seed)
+    rows = [('q1', 1000 * i, 1000 * i + 500, 't1', 1000 * i, 1000 * i + 500, 1, '+') for i in range(200)]
+    syn = synteny.Synteny(rows=rows)
+    gene = genome.Gene(name='gene', contig=contigs.intern('q1'), start=100000, stop=101000)
+    hits = []
+    for _ in range(nhits):
+        if hits and rng.random() < dup_rate:
+            row = rng.choice(hits)
+        else:
+            start = rng.randint(90000, 110000)
+            row = ['gene', '1', '300', '+', 't1', str(start), str(start + 300), '+', str(rng.randint(1, 1000))]
+        hits.append(row)
+    return(syn, gene, [exonerate.Hit(row) for row in hits])
+
+def run(merger_class, syn, gene, hits):
+    synmer = syn_merger.SynMerger(width=10)
+    merger = merger_class(flank_width=25000, min_neighbors=3, target_flank_ratio=2, quiet=True)
+    result = result_manager.Result(gene)
+    synmer.merge(result=result, syn=syn)
+    t0 = time.perf_counter()
+    merger.merge_all(result=result, hits=hits, syn=syn)
+    return(time.perf_counter() - t0, len(result.hits))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--hits', type=int, default=10000)
+    parser.add_argument('--dup-rate', type=float, default=0.3)
+    args = parser.parse_args()
+
+    syn, gene, hits = make_inputs(args.hits, args.dup_rate)
+    print('%-12s %10s %10s' % ('method', 'seconds', 'kept'))
+    for name, cls in (('list scan', ListScanHitMerger), ('hash set', hit_merger.HitMerger)):
+        seconds, kept = run(cls, syn, gene, hits)
+        print('%-12s %10.3f %10d' % (name, seconds, kept))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+'''
+Measure the time and peak memory of loading a synteny table.
+
+Writes a synthetic SatsumaSynteny table (unless --syn-file is given), then
+loads it with lib.synteny.Synteny and reports the input size, the bytes held
+by the final query and target indices, and the growth in peak RSS over the
+load. The table is written by a child process, so generating it does not
+raise the peak RSS of this one before the load. Run from the repository root:
+
+    python3 -m bench.load --rows 1000000
+'''
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+from lib.synteny import Synteny
+
+import bench.synth as synth
+from bench.synth import Scale
+
+def write_synteny(path, rows, contigs=20, seed=42):
+    scale = Scale(contigs=contigs, blocks=max(1, rows // contigs), seed=seed)
+    with open(path, 'w') as f:
+        synth.write_synteny(f, scale, random.Random(seed))
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--syn-file')
+    args = parser.parse_args()
+
+    path = args.syn_file
+    if not path:
+        handle, path = tempfile.mkstemp(suffix='.tab')
+        os.close(handle)
+        writer = multiprocessing.Process(target=write_synteny, args=(path, args.rows))
+        writer.start()
+        writer.join()
+        if writer.exitcode != 0:
+            os.remove(path)
+            raise SystemExit('Failed to write the synthetic synteny table')
+
+    size = os.path.getsize(path)
+    try:
+        before = peak_rss()
+        t0 = time.perf_counter()
+        with open(path) as f:
+            syn = Synteny(f)
+        elapsed = time.perf_counter() - t0
+        growth = peak_rss() - before
+    finally:
+        if not args.syn_file:
+            os.remove(path)
+
+    mb = 1024 ** 2
+    index = syn.query.nbytes() + syn.target.nbytes()
+    print('load time (s)     %10.2f' % elapsed)
+    print('input size (MB)   %10.1f' % (size / mb))
+    print('index size (MB)   %10.1f' % (index / mb))
+    print('peak growth (MB)  %10.1f' % (growth / mb))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+Measure the memory cost of one synteny block in each representation.
+
+Builds a synthetic synteny table of --rows blocks three ways and reports the
+bytes traced per block, along with the projected total for --project rows:
+
+    dict        linked MappedInterval pairs, as before __slots__ (per-instance
+                __dict__, reproduced here with equivalent plain classes)
+    slots       linked MappedInterval pairs with __slots__
+    columnar    the ColumnarIntervalSet pair used by Synteny
+
+Contig names are made per row, as str.split would, and rows are linked into
+per-contig lists as IntervalSet does. Run from the repository root:
+
+    python3 -m bench.memory --rows 1000000 --project 10000000
+'''
+
+import argparse
+import collections
+import gc
+import random
+import tracemalloc
+
+import lib.intervals as intervals
+from lib.columnar import ColumnarIntervalSet
+
+class DictInterval:
+    def __init__(self, contig, start, stop):
+        self.contig = contig
+        self.start = start
+        self.stop = stop
+        self.last = None
+        self.next = None
+        self.over = None
+        self.score = None
+
+def make_rows(n, contigs=20, seed=42):
+    rng = random.Random(seed)
+    rows = []
+    pos = 0
+    for k in range(n):
+        pos += rng.randint(100, 2000)
+        width = rng.randint(50, 1000)
+        rows.append((k % contigs, pos, pos + width, rng.random()))
+    return(rows)
+
+def build_linked(cls, rows):
+    '''
+    Build query and target intervals for every row, linked through over and
+    through last/next within each contig
+    '''
+    contigs = collections.defaultdict(list)
+    for contig, start, stop, score in rows:
+        q = cls(contig='q%d' % contig, start=start, stop=stop)
+        t = cls(contig='t%d' % contig, start=start, stop=stop)
+        q.over, t.over = t, q
+        q.score, t.score = score, score
+        contigs[q.contig].append(q)
+        contigs[t.contig].append(t)
+    for group in contigs.values():
+        for a, b in zip(group, group[1:]):
+            a.next, b.last = b, a
+    return(contigs)
+
+def build_columnar(rows):
+    query = ColumnarIntervalSet.from_columns(
+        ['q%d' % r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows])
+    target = ColumnarIntervalSet.from_columns(
+        ['t%d' % r[0] for r in rows], [r[1] for r in rows], [r[2] for r in rows], [r[3] for r in rows])
+    ColumnarIntervalSet.pair(query, target)
+    return((query, target))
+
+def traced(build, rows):
+    '''
+    The bytes still allocated by build(rows) once it returns
+    '''
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(rows)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return(after - before)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--project', type=int, default=10000000)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    builds = (
+        ('dict',     lambda r: build_linked(DictInterval, r)),
+        ('slots',    lambda r: build_linked(intervals.MappedInterval, r)),
+        ('columnar', build_columnar)
+    )
+    print('%-10s %16s %18s' % ('layout', 'bytes per block', 'GB at %d' % args.project))
+    for name, build in builds:
+        per_block = traced(build, rows) / args.rows
+        print('%-10s %16.1f %18.2f' % (name, per_block, per_block * args.project / 1024 ** 3))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+'''
+Benchmark overlap queries against dense, nested synteny tracks.
+
+Compares the old linked-list walk (which stops at the first non-overlapping
+neighbour of the anchor) with the IntervalIndex used by ColumnarIntervalSet.
+For each track size it reports the time per query and how many overlaps each
+method found. Run from the repository root:
+
+    python3 -m bench.overlap --sizes 10000 100000 1000000
+'''
+
+import argparse
+import random
+import time
+
+import lib.intervals as intervals
+from lib.columnar import ColumnarIntervalSet
+
+def dense_track(n, seed=42):
+    '''
+    Make n blocks on one contig with a block starting every 10 bases. Most are
+    short, but a few span tens of kilobases, so short blocks are nested inside
+    long ones as in high-density synteny tracks.
+    '''
+    rng = random.Random(seed)
+    starts, stops = [], []
+    for i in range(n):
+        start = i * 10
+        if rng.random() < 0.01:
+            width = rng.randint(10000, 50000)
+        else:
+            width = rng.randint(5, 50)
+        starts.append(start)
+        stops.append(start + width)
+    return(starts, stops)
+
+def walk_overlapping(iset, bound):
+    '''
+    The pre-index algorithm: anchor, then walk outwards through last/next until
+    a block fails to overlap
+    '''
+    anchor = iset.anchor(bound)
+    if not intervals.overlaps(anchor, bound):
+        return []
+    found = [anchor]
+    for step in ('last', 'next'):
+        q = getattr(anchor, step)
+        while q and intervals.overlaps(bound, q):
+            found.append(q)
+            q = getattr(q, step)
+    return(found)
+
+def run(n, nqueries, width):
+    starts, stops = dense_track(n)
+    iset = ColumnarIntervalSet.from_columns(['chr1'] * n, starts, stops)
+    rng = random.Random(n)
+    queries = []
+    for _ in range(nqueries):
+        start = rng.randint(0, n * 10)
+        queries.append(intervals.Interval('chr1', start, start + width))
+
+    # build the index outside of the query timings
+    t0 = time.perf_counter()
+    iset.contigs['chr1'].index
+    build = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    walked = sum(len(walk_overlapping(iset, q)) for q in queries)
+    t1 = time.perf_counter()
+    indexed = sum(len(iset.get_overlapping(q)) for q in queries)
+    t2 = time.perf_counter()
+
+    us = 1e6 / nqueries
+    print('%10d %10.2f %12.1f %12.1f %12d %12d' % (n, build, (t1 - t0) * us, (t2 - t1) * us, walked, indexed))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--width', type=int, default=1000)
+    args = parser.parse_args()
+
+    print('%10s %10s %12s %12s %12s %12s' % ('blocks', 'build_s', 'walk_us', 'index_us', 'walk_hits', 'index_hits'))
+    for n in args.sizes:
+        run(n, args.queries, args.width)
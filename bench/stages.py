@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+'''
+Time each stage of the fagin pipeline on synthetic inputs.
+
+Generates inputs with bench.synth (or reuses --input-dir), then runs the
+pipeline one stage at a time, reporting wall and CPU seconds, and the peak
+memory. By default the peak is the process RSS high-water mark after each
+stage (inputs are generated in a child process, so they do not raise it);
+with --tracemalloc it is the peak traced allocation within the stage,
+which isolates stages but slows them down. Run from the repository root:
+
+    python3 -m bench.stages --contigs 10 --blocks 20000 --genes 20000 --hits 20
+'''
+
+import argparse
+import contextlib
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import lib.genome as genome
+import lib.synteny as synteny
+import lib.exonerate as exonerate
+import lib.syn_merger as syn_merger
+import lib.hit_merger as hit_merger
+import lib.result_manager as result_manager
+import lib.writer as writer
+
+from bench.synth import Scale, generate
+
+class Timer:
+    def __init__(self, traced):
+        self.traced = traced
+        self.rows = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.traced:
+            tracemalloc.start()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if self.traced:
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            # ru_maxrss is in kilobytes on Linux
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.rows.append((name, wall, cpu, peak))
+
+    def report(self):
+        print('%-14s %10s %10s %12s' % ('stage', 'wall_s', 'cpu_s', 'peak_MB'))
+        for name, wall, cpu, peak in self.rows:
+            print('%-14s %10.2f %10.2f %12.1f' % (name, wall, cpu, peak / 1024 ** 2))
+        print('%-14s %10.2f %10.2f' % ('total', sum(r[1] for r in self.rows), sum(r[2] for r in self.rows)))
+
+class TimedResultManager(result_manager.ResultManager):
+    '''
+    A ResultManager that times its synteny and hit merges as separate stages
+    '''
+    timer = None
+
+    def _merge_synteny(self, *args, **kwargs):
+        with self.timer.stage('SynMerger'):
+            super()._merge_synteny(*args, **kwargs)
+
+    def _merge_hits(self, *args, **kwargs):
+        with self.timer.stage('HitMerger'):
+            return(super()._merge_hits(*args, **kwargs))
+
+def run(paths, args, timer):
+    with timer.stage('Synteny load'):
+        with open(paths['syn']) as f:
+            syn = synteny.Synteny(f)
+
+    with timer.stage('index build'):
+        for iset in (syn.query, syn.target):
+            for col in iset.contigs.values():
+                col.index
+
+    with timer.stage('Genome load'):
+        with open(paths['gen']) as f:
+            gen = genome.Genome(f)
+
+    TimedResultManager.timer = timer
+    with open(paths['hit']) as f:
+        res = TimedResultManager(
+            gen          = gen,
+            syn          = syn,
+            exo          = exonerate.Exonerate(f),
+            syn_merger   = syn_merger.SynMerger(width=args.syn_context_width),
+            hit_merger   = hit_merger.HitMerger(
+                flank_width        = args.hit_flank_width,
+                min_neighbors      = args.hit_min_neighbors,
+                target_flank_ratio = args.hit_target_flank_ratio,
+                quiet              = True),
+            hit_analyzer = None
+        )
+
+    with timer.stage('write'):
+        with writer.TsvWriter(os.devnull) as out:
+            res.write(out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    Scale.add_arguments(parser)
+    parser.add_argument('--input-dir', help='reuse inputs generated by bench.synth')
+    parser.add_argument('--tracemalloc', action='store_true', help='trace peak memory per stage')
+    parser.add_argument('--syn-context-width', type=int, default=10)
+    parser.add_argument('--hit-flank-width', type=int, default=25000)
+    parser.add_argument('--hit-min-neighbors', type=int, default=3)
+    parser.add_argument('--hit-target-flank-ratio', type=float, default=2)
+    args = parser.parse_args()
+
+    timer = Timer(traced=args.tracemalloc)
+    if args.input_dir:
+        paths = {k: os.path.join(args.input_dir, v) for k, v in
+                 (('syn', 'syn.tab'), ('gen', 'gen.gff'), ('hit', 'hits.tab'))}
+        run(paths, args, timer)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            with timer.stage('generate'), multiprocessing.Pool(1) as pool:
+                paths = pool.apply(generate, (tmp, Scale.from_args(args)))
+            run(paths, args, timer)
+    timer.report()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+'''
+Benchmark SynMerger on a dense genome, one gene at a time against merge_all.
+
+The default scale resembles a plant genome: about 40k genes on a handful of
+chromosomes, with synteny blocks only a few times denser than genes. Both
+methods are run on the same inputs and checked to agree on every gene. Run
+from the repository root:
+
+    python3 -m bench.synmerger --contigs 5 --blocks 20000 --genes 40000
+'''
+
+import argparse
+import tempfile
+import time
+
+import lib.genome as genome
+import lib.synteny as synteny
+import lib.syn_merger as syn_merger
+from lib.result_manager import Result
+
+from bench.synth import Scale, generate
+
+def state(result):
+    return((result.is_present, result.is_simple, str(result.lower), str(result.upper), result.context))
+
+def run(paths, width):
+    with open(paths['syn']) as f:
+        syn = synteny.Synteny(f)
+    with open(paths['gen']) as f:
+        gen = genome.Genome(f)
+    # build the overlap indices up front, so neither method pays for them
+    for iset in (syn.query, syn.target):
+        for col in iset.contigs.values():
+            col.index
+
+    merger = syn_merger.SynMerger(width=width)
+    times = {}
+    states = {}
+    for method in ('merge', 'merge_all'):
+        results = [Result(g) for g in gen.intervals()]
+        t0 = time.perf_counter()
+        if method == 'merge':
+            for result in results:
+                merger.merge(result=result, syn=syn)
+        else:
+            merger.merge_all(results=results, syn=syn)
+        times[method] = time.perf_counter() - t0
+        states[method] = [state(r) for r in results]
+
+    assert states['merge'] == states['merge_all'], 'merge and merge_all disagree'
+    ngenes = len(states['merge'])
+    print('%-10s %10s %12s' % ('method', 'total_s', 'us_per_gene'))
+    for method, seconds in times.items():
+        print('%-10s %10.2f %12.1f' % (method, seconds, 1e6 * seconds / ngenes))
+    print('genes %d, simple %d, speedup %.1fx' % (
+        ngenes, sum(s[1] for s in states['merge']), times['merge'] / times['merge_all']))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    Scale.add_arguments(parser)
+    parser.set_defaults(contigs=5, blocks=20000, genes=40000, hits=0)
+    parser.add_argument('--syn-context-width', type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        run(generate(tmp, Scale.from_args(args)), args.syn_context_width)
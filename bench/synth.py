@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+'''
+Generate synthetic fagin inputs at configurable scales.
+
+Writes a SatsumaSynteny table, a GFF of query genes and an 8 or 14 column
+exonerate hit table into a directory. Synteny blocks run colinearly along each
+query contig onto a matching target contig, except that a --rearrangement
+fraction of blocks map to a random place on a random target contig. Most hits
+of a gene land near its syntenic position in the target, the rest anywhere.
+Run from the repository root:
+
+    python3 -m bench.synth out/ --contigs 10 --blocks 20000 --genes 20000
+'''
+
+import argparse
+import bisect
+import os
+import random
+
+class Scale:
+    def __init__(self, contigs=10, blocks=10000, genes=5000, hits=10,
+                 rearrangement=0.05, intron=False, shuffle=False, seed=42):
+        self.contigs = contigs            # number of query (and target) contigs
+        self.blocks = blocks              # synteny blocks per query contig
+        self.genes = genes                # total number of genes
+        self.hits = hits                  # mean hits per gene
+        self.rearrangement = rearrangement
+        self.intron = intron              # write the 14 column hit format
+        self.shuffle = shuffle            # shuffle the hit rows rather than grouping by gene
+        self.seed = seed
+
+    @classmethod
+    def add_arguments(cls, parser):
+        d = cls()
+        parser.add_argument('--contigs', type=int, default=d.contigs)
+        parser.add_argument('--blocks', type=int, default=d.blocks, help='synteny blocks per contig')
+        parser.add_argument('--genes', type=int, default=d.genes)
+        parser.add_argument('--hits', type=int, default=d.hits, help='mean hits per gene')
+        parser.add_argument('--rearrangement', type=float, default=d.rearrangement,
+                            help='fraction of blocks mapping off the colinear path')
+        parser.add_argument('--intron', action='store_true', help='write 14 column hits')
+        parser.add_argument('--shuffle', action='store_true', help='do not group hits by gene')
+        parser.add_argument('--seed', type=int, default=d.seed)
+
+    @classmethod
+    def from_args(cls, args):
+        return(cls(contigs=args.contigs, blocks=args.blocks, genes=args.genes, hits=args.hits,
+                   rearrangement=args.rearrangement, intron=args.intron, shuffle=args.shuffle,
+                   seed=args.seed))
+
+class Layout:
+    '''
+    The query start, target contig and target start of every block, per query
+    contig, used to place genes and their hits
+    '''
+    def __init__(self):
+        self.qstarts = []
+        self.targets = []
+        self.length = []
+
+    def add_contig(self):
+        self.qstarts.append([])
+        self.targets.append([])
+        self.length.append(0)
+
+    def ortholog(self, contig, pos):
+        '''
+        Where pos on a query contig maps to in the target
+        '''
+        i = max(bisect.bisect_right(self.qstarts[contig], pos) - 1, 0)
+        tcontig, tstart = self.targets[contig][i]
+        return(tcontig, tstart + pos - self.qstarts[contig][i])
+
+def write_synteny(f, scale, rng):
+    layout = Layout()
+    for c in range(scale.contigs):
+        layout.add_contig()
+        qpos = tpos = 0
+        for _ in range(scale.blocks):
+            qpos += rng.randint(100, 2000)
+            tpos += rng.randint(100, 2000)
+            width = rng.randint(50, 3000)
+            if rng.random() < scale.rearrangement:
+                tcontig, tstart = rng.randrange(scale.contigs), rng.randint(0, 1000 * scale.blocks)
+            else:
+                tcontig, tstart = c, tpos
+            f.write('q%d\t%d\t%d\tt%d\t%d\t%d\t%.3f\t+\n' % (
+                c, qpos, qpos + width, tcontig, tstart, tstart + width, rng.random()))
+            layout.qstarts[-1].append(qpos)
+            layout.targets[-1].append((tcontig, tstart))
+        layout.length[-1] = qpos
+    return(layout)
+
+def write_genome(f, scale, layout, rng):
+    genes = []
+    for g in range(scale.genes):
+        contig = rng.randrange(scale.contigs)
+        start = rng.randint(0, max(layout.length[contig], 1))
+        stop = start + rng.randint(500, 5000)
+        name = 'gene%d' % g
+        f.write('q%d\tsynth\tgene\t%d\t%d\t.\t+\t.\t%s\n' % (contig, start, stop, name))
+        genes.append((name, contig, start))
+    return(genes)
+
+def hit_rows(scale, layout, genes, rng):
+    for name, contig, start in genes:
+        tcontig, tpos = layout.ortholog(contig, start)
+        for _ in range(rng.randint(0, 2 * scale.hits)):
+            if rng.random() < 0.7:
+                hcontig, hpos = tcontig, max(0, tpos + rng.randint(-5000, 5000))
+            else:
+                hcontig, hpos = rng.randrange(scale.contigs), rng.randint(0, 1000 * scale.blocks)
+            qlen = rng.randint(30, 600)
+            row = [name, '1', str(qlen), '+', 't%d' % hcontig, str(hpos), str(hpos + 3 * qlen), '+',
+                   '%.1f' % rng.uniform(20, 3000)]
+            if scale.intron:
+                nintron = rng.choice((0, 0, 1, 2, 5))
+                row += [str(rng.choice((0, 0, 0, rng.randint(1, qlen)))),
+                        str(int(rng.random() < 0.05)),
+                        str(rng.randint(0, nintron)),
+                        str(nintron),
+                        str(rng.randint(50, 20000) if nintron else 0)]
+            yield('\t'.join(row) + '\n')
+
+def write_hits(f, scale, layout, genes, rng):
+    ncol = 14 if scale.intron else 8
+    f.write('\t'.join('col%d' % i for i in range(ncol)) + '\n')
+    rows = hit_rows(scale, layout, genes, rng)
+    if scale.shuffle:
+        rows = list(rows)
+        rng.shuffle(rows)
+    f.writelines(rows)
+
+def generate(directory, scale):
+    '''
+    Write syn.tab, gen.gff and hits.tab into directory, returning their paths
+    '''
+    rng = random.Random(scale.seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = {k: os.path.join(directory, v) for k, v in
+             (('syn', 'syn.tab'), ('gen', 'gen.gff'), ('hit', 'hits.tab'))}
+    with open(paths['syn'], 'w') as f:
+        layout = write_synteny(f, scale, rng)
+    with open(paths['gen'], 'w') as f:
+        genes = write_genome(f, scale, layout, rng)
+    with open(paths['hit'], 'w') as f:
+        write_hits(f, scale, layout, genes, rng)
+    return(paths)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('directory')
+    Scale.add_arguments(parser)
+    args = parser.parse_args()
+    for path in generate(args.directory, Scale.from_args(args)).values():
+        print(path)
@@ -1,23 +1,36 @@
 #!/usr/bin/env python3
 
+import time
+
+# taken before the other imports, so --print-startup-time counts them
+_START = time.perf_counter()
+
 import argparse
 import os
+import sys
 
+# only what parsing the arguments needs is imported here. The modules of
+# each mode are imported by the function that runs it, so --version, --help
+# and the light modes do not pay for the rest (see --print-startup-time)
 import lib.util           as util
-import lib.genome         as genome
-import lib.synteny        as synteny
-import lib.exonerate      as exonerate
-import lib.hit_merger     as hit_merger
-import lib.syn_merger     as syn_merger
-import lib.hit_analyzer   as hit_analyzer
-import lib.result_manager as result_manager
+import lib.compressed     as compressed
+import lib.writer         as writer
 
 __version__ = '0.0.1'
 
 def parse(argv=None):
     parser = argparse.ArgumentParser(
         description='Discover and categorize orphan genes',
-        usage='fagin [options]'
+        usage='fagin [run|index|sweep|serve] [options]'
+    )
+
+    parser.add_argument(
+        'mode',
+        help="'run' the analysis (default), 'index' the inputs into --cache-dir and exit, 'sweep' a --grid of "
+             "parameters, or 'serve' the synteny index to other runs as --shared NAME until interrupted",
+        nargs='?',
+        choices=('run', 'index', 'sweep', 'serve'),
+        default='run'
     )
 
     parser.add_argument(
@@ -34,6 +47,14 @@ def parse(argv=None):
         default='output'
     )
 
+    parser.add_argument(
+        '-f', '--format',
+        help='format of the kept hits written to the output directory: tsv (default), '
+             'columnar (memory-mappable arrays, see lib/cache.py) or parquet (requires pyarrow)',
+        choices=tuple(writer.FORMATS),
+        default='tsv'
+    )
+
     parser.add_argument(
         '-q', '--quiet',
         help='suppress "contig with no syntenic block" warnings',
@@ -41,30 +62,88 @@ def parse(argv=None):
         default=False
     )
 
+    parser.add_argument(
+        '--streaming',
+        help='merge and write one gene at a time, in hit file order, using constant memory per gene (ignores --jobs)',
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        '--profile',
+        help='write per-stage timings and counters to profile.json in the output directory',
+        action="store_true",
+        default=False
+    )
+
+    parser.add_argument(
+        '--print-startup-time',
+        help='print the time taken to start up, before any input is read, to stderr',
+        action="store_true",
+        default=False
+    )
+
     # === INPUTS ===
 
     parser.add_argument(
         '-g', '--gen-file',
-        help='gff formated gene models for the query species',
-        type=argparse.FileType('r')
+        help='gff formated gene models for the query species (may be gzip, bgzip or zstd compressed, as may the other inputs)',
+        type=compressed.open_input
     )
 
     parser.add_argument(
         '-s', '--syn-file',
         help='output tabular output from SatsumaSynteny (query versus target)',
-        type=argparse.FileType('r')
+        type=compressed.open_input
     )
 
     parser.add_argument(
         '-t', '--hit-file',
         help='the parsed output of Exonerate',
-        type=argparse.FileType('r')
+        type=compressed.open_input
     )
 
     parser.add_argument(
         '-N', '--nstr-file',
-        help='tab-delimited file representing chr, start, and length of N repeats in target genome',
-        type=argparse.FileType('r')
+        help='tab-delimited file representing chr, start, and length of N repeats in target genome. Hits mostly '
+             'in N are dropped (see --max-n-fraction), and the fraction of the target between the blocks flanking '
+             'each gene that is N is written to target_gaps.tsv in the output directory',
+        type=compressed.open_input
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        help='directory of binary input indices written by `fagin index` and read by later runs',
+        default='.fagin-cache'
+    )
+
+    parser.add_argument(
+        '--shared',
+        help="name of a synteny index kept in shared memory by `fagin serve --shared NAME`, "
+             "which 'run' and 'sweep' map read-only in place of --syn-file",
+        metavar='NAME'
+    )
+
+    parser.add_argument(
+        '--reuse',
+        help='output directory of an earlier run on the same synteny and gff files, made with --save-state, '
+             'whose saved state is reused so that only the genes whose hits changed are merged again',
+        metavar='DIR'
+    )
+
+    parser.add_argument(
+        '--save-state',
+        help='save the merge state of every gene in the output directory, for later runs to --reuse',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '-j', '--jobs',
+        help='number of worker processes, genes on different query contigs are merged in parallel',
+        metavar='N',
+        type=int,
+        default=1
     )
 
     # === PARAMETERS ===
@@ -98,41 +177,248 @@ def parse(argv=None):
         default=10
     )
 
+    parser.add_argument(
+        '--max-n-fraction',
+        help='with --nstr-file, drop hits whose target is more than this fraction N (default 0.5)',
+        metavar='F',
+        type=float,
+        default=0.5
+    )
+
+    parser.add_argument(
+        '--min-syn-score',
+        help='drop synteny blocks whose proportion identity (column 7) is below this when they are loaded',
+        metavar='S',
+        type=float
+    )
+
+    parser.add_argument(
+        '--min-hit-score',
+        help='drop kept hits scoring below this',
+        metavar='S',
+        type=float
+    )
+
+    parser.add_argument(
+        '--no-frameshift',
+        help='drop hits with a frameshift (requires the 14 column hit format, as do the next two)',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '--no-premature-stop',
+        help='drop hits with a stop codon before the end of the aligned query',
+        action='store_true',
+        default=False
+    )
+
+    parser.add_argument(
+        '--max-intron',
+        help='drop hits with an intron longer than this',
+        metavar='N',
+        type=int
+    )
+
+    parser.add_argument(
+        '--grid',
+        help="for sweep, a parameter and the values to try, e.g. 'hit-flank-width=10000,25000' (may be repeated). "
+             "Parameters not in the grid keep their single value. One output file per combination is written to the output directory",
+        metavar='NAME=V1,V2,...',
+        action='append'
+    )
+
     args = parser.parse_args(argv)
     return(args)
 
+def check_output_directory(args):
+    '''
+    Exit if the output directory can not be used, before any input is loaded.
+    It is only made by prepare_output_directory once the run will go ahead.
+    '''
+    # a missing package fails here, not after the merge
+    writer.check_format(args.format)
+    if os.path.isdir(args.output_dir):
+        if os.listdir(args.output_dir):
+            util.err('Output directory must be empty')
+    elif not os.access(os.path.dirname(os.path.abspath(args.output_dir)), os.W_OK):
+        util.err("You don't have permission to make directory '%s'" % args.output_dir)
+
 def prepare_output_directory(args):
     try:
         os.mkdir(args.output_dir)
     except FileExistsError:
         if(os.listdir(args.output_dir)):
-            err('Output directory must be empty')
+            util.err('Output directory must be empty')
     except PermissionError:
-        err("You don't have permission to make directory '%s'" % args.output_dir)
+        util.err("You don't have permission to make directory '%s'" % args.output_dir)
 
+def sweep_grid(args):
+    import lib.sweep as sweep
+    defaults = {k: getattr(args, k.replace('-', '_')) for k in sweep.PARAMETERS}
+    return(sweep.parse_grid(args.grid, defaults))
 
-if __name__ == '__main__':
-    args = parse()
+def print_startup_time(args):
+    '''
+    With --print-startup-time, report the time taken until the selected mode
+    starts work: the wall time since fagin.py began importing, and the CPU
+    time of the whole process, which includes starting the interpreter
+    '''
+    if args.print_startup_time:
+        msg = 'startup: %.1f ms since fagin.py began importing, %.1f ms CPU time since the process began'
+        print(msg % (1000 * (time.perf_counter() - _START), 1000 * time.process_time()), file=sys.stderr)
+
+def build_indices(args):
+    import lib.cache as cache
+    print_startup_time(args)
+    inputs = (
+        (args.syn_file, 'synteny'),
+        (args.gen_file, 'genome'),
+        (args.hit_file, 'hits')
+    )
+    for handle, kind in inputs:
+        if handle:
+            cache.build(handle, kind, args.cache_dir)
+
+def serve_synteny(args):
+    import lib.cache as cache
+    import lib.shared as shared
+    print_startup_time(args)
+    if not args.shared:
+        util.err("'serve' needs the --shared NAME to serve the synteny index as")
+    syn = cache.load(args.syn_file, 'synteny', args.cache_dir, min_score=args.min_syn_score)
+    path = cache.source_path(args.syn_file)
+    shared.publish(syn, args.shared, cache.source_stamp(path) if path else None)
+    # runs map the shared copy, so this one can go
+    del syn
+    shared.serve(args.shared)
+
+def run(args):
+    '''
+    The run and sweep modes
+    '''
+    import lib.cache          as cache
+    import lib.profiler       as profiler
+    import lib.state          as state
+    import lib.nstrings       as nstrings
+    import lib.hit_merger     as hit_merger
+    import lib.syn_merger     as syn_merger
+    import lib.hit_analyzer   as hit_analyzer
+    import lib.result_manager as result_manager
+    print_startup_time(args)
+
+    # fail on an unusable output directory or options before any input is loaded
+    check_output_directory(args)
+    if (args.reuse or args.save_state) and (args.streaming or args.mode == 'sweep'):
+        util.err("--reuse and --save-state only apply to the 'run' mode without --streaming")
+    if args.reuse and args.shared:
+        util.err('--reuse needs the synteny file the state was made from, not --shared')
+
+    prof = profiler.Profiler() if args.profile else profiler.NullProfiler()
+
+    nstr = None
+    if args.nstr_file:
+        with prof.stage('load nstrings'):
+            nstr = nstrings.NStrings(args.nstr_file)
 
     syn_merger = syn_merger.SynMerger(
-        width = args.syn_context_width
+        width    = args.syn_context_width,
+        profiler = prof,
+        nstrings = nstr
     )
 
     hit_merger = hit_merger.HitMerger(
         flank_width        = args.hit_flank_width,
         min_neighbors      = args.hit_min_neighbors,
         target_flank_ratio = args.hit_target_flank_ratio,
-        quiet              = args.quiet
+        quiet              = args.quiet,
+        profiler           = prof,
+        nstrings           = nstr,
+        max_n_fraction     = args.max_n_fraction
     )
 
-    hit_analyzer = hit_analyzer.HitAnalyzer()
+    hit_analyzer = hit_analyzer.HitAnalyzer(
+        min_score         = args.min_hit_score,
+        no_frameshift     = args.no_frameshift,
+        no_premature_stop = args.no_premature_stop,
+        max_intron        = args.max_intron,
+        profiler          = prof
+    )
+
+    with prof.stage('load genome'):
+        gen = cache.load(args.gen_file, 'genome', args.cache_dir)
+    with prof.stage('load synteny'):
+        if args.shared:
+            import lib.shared as shared
+            syn = shared.attach(args.shared)
+            if args.min_syn_score is not None:
+                syn.cut_low_score_pairs(args.min_syn_score)
+        else:
+            syn = cache.load(args.syn_file, 'synteny', args.cache_dir, min_score=args.min_syn_score)
+    # hits are parsed lazily, during the merge
+    exo = cache.load(args.hit_file, 'hits', args.cache_dir)
+
+    saved = None
+    if args.reuse:
+        saved = state.State.load(args.reuse)
+        saved.check(state.parameters(syn_merger, hit_merger, syn=syn), args.gen_file, args.syn_file, args.nstr_file)
 
-    res = result_manager.ResultManager(
-        gen          = genome.Genome(args.gen_file),
-        syn          = synteny.Synteny(args.syn_file),
-        exo          = exonerate.Exonerate(args.hit_file),
+    # only made now, so a rejected --reuse leaves nothing behind
+    prepare_output_directory(args)
+
+    inputs = dict(
+        gen          = gen,
+        syn          = syn,
+        exo          = exo,
         hit_merger   = hit_merger,
         syn_merger   = syn_merger,
-        hit_analyzer = hit_analyzer
+        hit_analyzer = hit_analyzer,
+        profiler     = prof
     )
-    res.write()
+
+    if args.mode == 'sweep':
+        import lib.sweep as sweep
+        with prof.stage('sweep'):
+            sweeper = sweep.Sweep(
+                gen            = gen,
+                syn            = syn,
+                exo            = exo,
+                grid           = sweep_grid(args),
+                jobs           = args.jobs,
+                quiet          = args.quiet,
+                format         = args.format,
+                nstrings       = nstr,
+                max_n_fraction = args.max_n_fraction,
+                hit_analyzer   = hit_analyzer
+            )
+            sweeper.write(args.output_dir)
+    else:
+        if args.streaming:
+            res = result_manager.StreamingResultManager(**inputs)
+        else:
+            with prof.stage('merge'):
+                res = result_manager.ResultManager(jobs=args.jobs, reuse=saved, keep_state=args.save_state, **inputs)
+        path = os.path.join(args.output_dir, 'hits' + writer.FORMATS[args.format])
+        # with N runs, each gene's target N fraction is written alongside
+        gaps = None if nstr is None else os.path.join(args.output_dir, writer.GAPS)
+        with prof.stage('write'), writer.open_writer(path, format=args.format, jobs=args.jobs, gaps=gaps) as out:
+            res.write(out)
+        if args.save_state:
+            with prof.stage('save state'):
+                res.state.write(args.output_dir, state.sources(args.gen_file, args.syn_file, args.nstr_file))
+
+    if args.profile:
+        # genes and hits are counted as they are merged, the synteny rows
+        # are those left after --min-syn-score
+        prof.count({'synteny rows kept': len(syn.query)})
+        prof.write(os.path.join(args.output_dir, 'profile.json'))
+
+if __name__ == '__main__':
+    args = parse()
+
+    if args.mode == 'index':
+        build_indices(args)
+    elif args.mode == 'serve':
+        serve_synteny(args)
+    else:
+        run(args)
@@ -0,0 +1,345 @@
+'''
+A binary cache of parsed inputs.
+
+`fagin index` parses the synteny, GFF and hit files once and writes each as a
+single file of sorted per-contig arrays, with contig and gene names kept in a
+string table. Later runs memory-map these files instead of re-parsing the
+text. Each cache file records the size, modification time and digest of the
+input it was built from, and is ignored once the input changes.
+
+A cache file is laid out as:
+
+    MAGIC
+    8 byte little-endian length of the header
+    JSON header (kind, source file stamp, metadata and column layout)
+    padding to 8 bytes
+    column data, each column aligned to 8 bytes
+'''
+
+import array
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+
+import lib.contigs as contigs
+from lib.columnar import ColumnarIntervalSet
+from lib.exonerate import Exonerate, IntronHit
+from lib.genome import Gene, Genome
+from lib.synteny import Synteny
+from lib.util import err
+
+MAGIC = b'FAGINIDX'
+VERSION = 1
+
+KINDS = ('synteny', 'genome', 'hits')
+
+def _pad(n):
+    return((-n) % 8)
+
+def file_digest(path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return(h.hexdigest())
+
+def source_stamp(path):
+    st = os.stat(path)
+    return({
+        'path'     : os.path.abspath(path),
+        'size'     : st.st_size,
+        'mtime_ns' : st.st_mtime_ns,
+        'digest'   : file_digest(path)
+    })
+
+def is_current(stamp, path):
+    '''
+    Check whether a cache built from stamp still matches the file at path. The
+    digest is only recomputed if the size matches but the mtime does not.
+    '''
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size != stamp['size']:
+        return False
+    if st.st_mtime_ns == stamp['mtime_ns']:
+        return True
+    return(file_digest(path) == stamp['digest'])
+
+def cache_path(cache_dir, path, kind):
+    '''
+    The cache file for an input is named after its base name and a hash of
+    its absolute path, so inputs with the same name do not collide
+    '''
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    name = '%s.%s.%s.fidx' % (os.path.basename(path), key, kind)
+    return(os.path.join(cache_dir, name))
+
+def write(path, kind, stamp, meta, columns):
+    '''
+    Write a cache file. columns maps a column name to a list of arrays that
+    are concatenated on disk; None marks an absent column.
+    '''
+    layout = {}
+    offset = 0
+    for name, parts in columns.items():
+        if not parts:
+            continue
+        length = sum(len(p) for p in parts)
+        typecode = parts[0].typecode
+        itemsize = array.array(typecode).itemsize
+        layout[name] = {'typecode': typecode, 'offset': offset, 'length': length}
+        offset += length * itemsize
+        offset += _pad(offset)
+
+    header = json.dumps({
+        'version'   : VERSION,
+        'kind'      : kind,
+        'byteorder' : sys.byteorder,
+        'source'    : stamp,
+        'meta'      : meta,
+        'columns'   : layout
+    }).encode()
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        start = len(MAGIC) + 8 + len(header)
+        f.write(b'\0' * _pad(start))
+        for name, parts in columns.items():
+            if not parts:
+                continue
+            size = 0
+            for part in parts:
+                f.write(part)
+                size += len(part) * part.itemsize
+            f.write(b'\0' * _pad(size))
+    os.replace(tmp, path)
+
+def read(path):
+    '''
+    Memory-map a cache file, returning its header and a dict of memoryviews
+    over its columns. Returns (None, None) if the file is not a usable cache.
+    '''
+    try:
+        with open(path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return(None, None)
+    if mm[:len(MAGIC)] != MAGIC:
+        return(None, None)
+    (size,) = struct.unpack_from('<Q', mm, len(MAGIC))
+    start = len(MAGIC) + 8
+    header = json.loads(mm[start:start + size].decode())
+    if header['version'] != VERSION or header['byteorder'] != sys.byteorder:
+        return(None, None)
+    start += size
+    start += _pad(start)
+    view = memoryview(mm)
+    columns = {}
+    for name, c in header['columns'].items():
+        itemsize = array.array(c['typecode']).itemsize
+        a = start + c['offset']
+        columns[name] = view[a:a + c['length'] * itemsize].cast(c['typecode'])
+    return(header, columns)
+
+# --- per-kind conversion between objects and columns ---
+
+# contig IDs are only meaningful within one run (see lib.contigs), so cache
+# files hold contig names
+
+def _dump_synteny(syn):
+    meta, columns = {}, {}
+    for side, iset in (('query', syn.query), ('target', syn.target)):
+        ids, flat = iset.to_flat()
+        meta[side] = list(map(contigs.name, ids))
+        for name, parts in flat.items():
+            columns['%s.%s' % (side, name)] = parts
+    meta['min_score'] = syn.min_score
+    return(meta, columns)
+
+def _load_synteny(meta, columns):
+    sets = []
+    for side in ('query', 'target'):
+        c = lambda name: columns.get('%s.%s' % (side, name))
+        sets.append(ColumnarIntervalSet.from_flat(
+            contigs    = contigs.intern_all(meta[side]),
+            offsets    = c('offsets'),
+            starts     = c('starts'),
+            stops      = c('stops'),
+            scores     = c('scores'),
+            rows       = c('rows'),
+            row_contig = c('row_contig'),
+            row_index  = c('row_index')
+        ))
+    syn = Synteny.from_sets(*sets)
+    syn.min_score = meta.get('min_score')
+    return(syn)
+
+def _string_table(values):
+    ids = {}
+    column = array.array('i', (ids.setdefault(v, len(ids)) for v in values))
+    return(list(ids), column)
+
+def _dump_genome(gen):
+    genes = list(gen.intervals())
+    names, contig_ids = _string_table(contigs.name(g.contig) for g in genes)
+    meta = {'names': [g.name for g in genes], 'contigs': names}
+    columns = {
+        'contig' : [contig_ids],
+        'start'  : [array.array('q', (g.start for g in genes))],
+        'stop'   : [array.array('q', (g.stop for g in genes))]
+    }
+    return(meta, columns)
+
+def _load_genome(meta, columns):
+    ids = contigs.intern_all(meta['contigs'])
+    genes = [Gene(name=n, contig=ids[c], start=a, stop=b) for n, c, a, b in
+             zip(meta['names'], columns['contig'], columns['start'], columns['stop'])]
+    return(Genome.from_genes(genes))
+
+INTRON_FIELDS = ('first_stop', 'has_frameshift', 'num_split_codons', 'num_intron', 'max_intron')
+
+def _dump_hits(exo):
+    return(hit_columns(exo.generator()))
+
+def hit_columns(hits):
+    '''
+    Convert hits to the metadata and columns of a hits cache file
+    '''
+    hits = iter(hits)
+    try:
+        first = next(hits)
+    except StopIteration:
+        first = None
+    intron = isinstance(first, IntronHit)
+    names, name_ids = {}, array.array('i')
+    targets, contig_ids = {}, array.array('i')
+    columns = {k: array.array('q') for k in ('gene_start', 'gene_stop', 'target_start', 'target_stop')}
+    columns['score'] = array.array('d')
+    for field in INTRON_FIELDS:
+        columns[field] = array.array('q') if intron else None
+    for hit in itertools.chain([first] if first else [], hits):
+        name_ids.append(names.setdefault(hit.name, len(names)))
+        contig_ids.append(targets.setdefault(hit.target.contig, len(targets)))
+        columns['gene_start'].append(hit.gene.start)
+        columns['gene_stop'].append(hit.gene.stop)
+        columns['target_start'].append(hit.target.start)
+        columns['target_stop'].append(hit.target.stop)
+        columns['score'].append(hit.score)
+        if intron:
+            for field in INTRON_FIELDS:
+                columns[field].append(getattr(hit, field))
+    columns['name'] = name_ids
+    columns['target'] = contig_ids
+    meta = {'ncol': 14 if intron else 8, 'names': list(names), 'contigs': list(map(contigs.name, targets))}
+    return(meta, {k: (None if v is None else [v]) for k, v in columns.items()})
+
+class _HitRows:
+    '''
+    Rebuilds hit rows from the cached columns each time it is iterated
+    '''
+    def __init__(self, meta, columns):
+        self.meta = meta
+        self.columns = columns
+
+    def __iter__(self):
+        c = self.columns
+        return(zip(
+            map(self.meta['names'].__getitem__, c['name']),
+            c['gene_start'],
+            c['gene_stop'],
+            itertools.repeat('.'),
+            map(self.meta['contigs'].__getitem__, c['target']),
+            c['target_start'],
+            c['target_stop'],
+            itertools.repeat('.'),
+            c['score'],
+            *(c[f] for f in INTRON_FIELDS if f in c)
+        ))
+
+def _load_hits(meta, columns):
+    return(Exonerate.from_rows(meta['ncol'], _HitRows(meta, columns)))
+
+def load_results(path):
+    '''
+    Read the kept hits written by fagin with --format columnar, as an
+    Exonerate object
+    '''
+    header, columns = read(path)
+    if header is None or header['kind'] != 'results':
+        err("'%s' is not a fagin results file" % path)
+    return(_load_hits(header['meta'], columns))
+
+_DUMP = {'synteny': _dump_synteny, 'genome': _dump_genome, 'hits': _dump_hits}
+_LOAD = {'synteny': _load_synteny, 'genome': _load_genome, 'hits': _load_hits}
+_PARSE = {'synteny': Synteny, 'genome': Genome, 'hits': Exonerate}
+
+def source_path(handle):
+    path = getattr(handle, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return(path)
+    return(None)
+
+def build(handle, kind, cache_dir):
+    '''
+    Parse an open input and write its cache, returning the parsed object.
+    Hits are consumed while writing, so the returned Exonerate is spent.
+    '''
+    path = source_path(handle)
+    if not path:
+        err("Cannot index '%s', only regular files can be cached" % getattr(handle, 'name', handle))
+    os.makedirs(cache_dir, exist_ok=True)
+    stamp = source_stamp(path)
+    obj = _PARSE[kind](handle)
+    save(cache_path(cache_dir, path, kind), kind, stamp, obj)
+    return(obj)
+
+def save(path, kind, stamp, obj):
+    '''
+    Write a parsed input to path in the cache layout
+    '''
+    meta, columns = _DUMP[kind](obj)
+    write(path, kind, stamp, meta, columns)
+
+def open_saved(path, kind):
+    '''
+    Memory-map an input written by save, returning its header and the
+    object, or (None, None) if path holds no input of that kind. Unlike
+    load, the source it was built from is not checked.
+    '''
+    header, columns = read(path)
+    if header is None or header['kind'] != kind:
+        return(None, None)
+    return(header, _LOAD[kind](header['meta'], columns))
+
+def _load(cpath, kind, path):
+    header, columns = read(cpath)
+    if header is None or header['kind'] != kind or not is_current(header['source'], path):
+        return None
+    return(_LOAD[kind](header['meta'], columns))
+
+def load(handle, kind, cache_dir, min_score=None):
+    '''
+    Load an input from its cache if one exists and is current, otherwise
+    parse the text. The cache is never written here, see build. For
+    synteny, blocks scoring below min_score are dropped, while parsing or
+    from the cached sets.
+    '''
+    path = source_path(handle)
+    if cache_dir and path:
+        obj = _load(cache_path(cache_dir, path, kind), kind, path)
+        if obj is not None:
+            if min_score is not None:
+                obj.cut_low_score_pairs(min_score)
+            return(obj)
+    if min_score is not None:
+        return(_PARSE[kind](handle, min_score=min_score))
+    return(_PARSE[kind](handle))
@@ -0,0 +1,472 @@
+import array
+import bisect
+import collections
+import itertools
+
+import lib.contigs as contigs
+from lib.intervals import IntervalIndex
+
+class Block:
+    '''
+    A view of one interval stored in a ColumnarIntervalSet. Blocks are built on
+    demand and expose the same attributes as a MappedInterval (contig, start,
+    stop, score, last, next and over), so they can be passed anywhere the
+    linked intervals are used.
+    '''
+    __slots__ = ('_col', '_i')
+
+    def __init__(self, col, i):
+        self._col = col
+        self._i = i
+
+    @property
+    def contig(self):
+        return(self._col.contig)
+
+    @property
+    def start(self):
+        return(self._col.starts[self._i])
+
+    @property
+    def stop(self):
+        return(self._col.stops[self._i])
+
+    @property
+    def score(self):
+        if self._col.scores is None:
+            return None
+        return(self._col.scores[self._i])
+
+    @property
+    def index(self):
+        '''
+        The position of this block in its contig's arrays
+        '''
+        return(self._i)
+
+    @property
+    def row(self):
+        '''
+        The input row this block was loaded from
+        '''
+        return(self._col.rows[self._i])
+
+    @property
+    def last(self):
+        if self._i > 0:
+            return Block(self._col, self._i - 1)
+        return None
+
+    @property
+    def next(self):
+        if self._i + 1 < len(self._col.starts):
+            return Block(self._col, self._i + 1)
+        return None
+
+    @property
+    def over(self):
+        partner = self._col.owner.over
+        if partner is None:
+            return None
+        return(partner.block(self.row))
+
+    def __str__(self):
+        return('\t'.join((contigs.label(self.contig), str(self.start), str(self.stop))))
+
+    def __eq__(self, other):
+        return (self.start  == other.start and
+                self.stop   == other.stop  and
+                self.contig == other.contig)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.contig, self.start, self.stop))
+
+class ContigColumns:
+    '''
+    The intervals of a single contig, stored as parallel arrays sorted by start
+    and stop. The rows array maps each position back to its input row.
+    '''
+    def __init__(self, owner, contig, starts, stops, scores, rows):
+        self.owner  = owner
+        self.contig = contig
+        self.starts = starts
+        self.stops  = stops
+        self.scores = scores
+        self.rows   = rows
+        self._index = None
+        self._reach = None
+
+    @property
+    def index(self):
+        '''
+        The IntervalIndex over this contig, built on first use
+        '''
+        if self._index is None:
+            self._index = IntervalIndex(self.starts, self.stops)
+        return(self._index)
+
+    @property
+    def reach(self):
+        '''
+        The furthest stop of the blocks up to each position, built on first
+        use. A block at or before position i overlaps an interval ending at or
+        after the start of block i only if reach[i] reaches its start.
+        '''
+        if self._reach is None:
+            self._reach = array.array('q', itertools.accumulate(self.stops, max))
+        return(self._reach)
+
+    def __len__(self):
+        return(len(self.starts))
+
+    def block(self, i):
+        '''
+        The block at position i, or None if i is outside the contig
+        '''
+        if 0 <= i < len(self.starts):
+            return(Block(self, i))
+        return None
+
+class ColumnarIntervalSet:
+    '''
+    An IntervalSet that stores contig, start, stop and score as typed arrays
+    rather than as one linked Python object per interval. Queries return Block
+    views, so the set is a drop-in replacement for IntervalSet.
+    '''
+    def __init__(self, intervals=()):
+        intervals = list(intervals)
+        scores = [getattr(x, 'score', None) for x in intervals]
+        if any(s is None for s in scores):
+            scores = None
+        self._build(
+            contigs = [x.contig for x in intervals],
+            starts  = [x.start  for x in intervals],
+            stops   = [x.stop   for x in intervals],
+            scores  = scores
+        )
+
+    @classmethod
+    def from_columns(cls, contigs, starts, stops, scores=None, names=None):
+        '''
+        Build a set from parallel sequences, one element per input row. The
+        row numbers are kept, so two sets built from the same rows (e.g. the
+        query and target sides of a synteny table) can be paired. If names is
+        given, contigs holds IDs into it (see lib.contigs), and the contigs
+        are ordered by name rather than by ID.
+        '''
+        obj = cls.__new__(cls)
+        obj._build(contigs=contigs, starts=starts, stops=stops, scores=scores, names=names)
+        return(obj)
+
+    def _build(self, contigs, starts, stops, scores, names=None):
+        self.over = None
+
+        groups = collections.defaultdict(lambda: array.array('q'))
+        for row, contig in enumerate(contigs):
+            groups[contig].append(row)
+
+        if names is None:
+            key = None
+        else:
+            key = names.__getitem__
+
+        self.contigs = collections.OrderedDict()
+        self._row_contig = array.array('i', bytes(4 * len(starts)))
+        self._row_index  = array.array('q', bytes(8 * len(starts)))
+        self._columns = []
+        for contig in sorted(groups, key=key):
+            rows = groups.pop(contig)
+            if not self._is_sorted(rows, starts, stops):
+                rows = array.array('q', self._sort_rows(rows, starts, stops))
+            col = ContigColumns(
+                owner  = self,
+                contig = contig,
+                starts = array.array('q', (starts[r] for r in rows)),
+                stops  = array.array('q', (stops[r] for r in rows)),
+                scores = None if scores is None else array.array('d', (scores[r] for r in rows)),
+                rows   = rows
+            )
+            cid = len(self._columns)
+            for i, row in enumerate(rows):
+                self._row_contig[row] = cid
+                self._row_index[row] = i
+            self._columns.append(col)
+            self.contigs[col.contig] = col
+
+    @classmethod
+    def from_flat(cls, contigs, offsets, starts, stops, scores, rows, row_contig, row_index):
+        '''
+        Rebuild a set from the output of to_flat. The columns may be arrays or
+        memoryviews (e.g. over a memory-mapped file), and are sliced per contig
+        without being parsed or sorted again.
+        '''
+        obj = cls.__new__(cls)
+        obj.over = None
+        obj.contigs = collections.OrderedDict()
+        obj._row_contig = row_contig
+        obj._row_index = row_index
+        obj._columns = []
+        for k, contig in enumerate(contigs):
+            a, b = offsets[k], offsets[k + 1]
+            col = ContigColumns(
+                owner  = obj,
+                contig = contig,
+                starts = starts[a:b],
+                stops  = stops[a:b],
+                scores = None if scores is None else scores[a:b],
+                rows   = rows[a:b]
+            )
+            obj._columns.append(col)
+            obj.contigs[contig] = col
+        return(obj)
+
+    def to_flat(self):
+        '''
+        Export the set as its contigs plus flat columns, each a list of
+        per-contig arrays in contig order. The offsets column marks where each
+        contig starts. The scores column is None if the set has no scores.
+        '''
+        offsets = array.array('q', [0])
+        for col in self._columns:
+            offsets.append(offsets[-1] + len(col))
+        has_scores = all(c.scores is not None for c in self._columns)
+        columns = {
+            'offsets'    : [offsets],
+            'starts'     : [c.starts for c in self._columns],
+            'stops'      : [c.stops  for c in self._columns],
+            'scores'     : [c.scores for c in self._columns] if has_scores else None,
+            'rows'       : [c.rows   for c in self._columns],
+            'row_contig' : [self._row_contig],
+            'row_index'  : [self._row_index]
+        }
+        return(list(self.contigs), columns)
+
+    def select(self, keep):
+        '''
+        A new set of only the rows for which keep is true, numbered again in
+        order. Each contig's arrays are filtered in their sorted order, so
+        nothing is sorted again, and contigs left empty are dropped.
+        '''
+        # the new number of each kept row is the count of kept rows before it
+        renumber = array.array('q', itertools.accumulate(keep, initial=-1))[1:]
+        n = renumber[-1] + 1 if renumber else 0
+        obj = self.__class__.__new__(self.__class__)
+        obj.over = None
+        obj.contigs = collections.OrderedDict()
+        obj._row_contig = array.array('i', bytes(4 * n))
+        obj._row_index = array.array('q', bytes(8 * n))
+        obj._columns = []
+        for col in self._columns:
+            mask = bytes(map(keep.__getitem__, col.rows))
+            if not any(mask):
+                continue
+            rows = array.array('q', map(renumber.__getitem__, itertools.compress(col.rows, mask)))
+            new = ContigColumns(
+                owner  = obj,
+                contig = col.contig,
+                starts = array.array('q', itertools.compress(col.starts, mask)),
+                stops  = array.array('q', itertools.compress(col.stops, mask)),
+                scores = None if col.scores is None else array.array('d', itertools.compress(col.scores, mask)),
+                rows   = rows
+            )
+            cid = len(obj._columns)
+            for i, row in enumerate(rows):
+                obj._row_contig[row] = cid
+                obj._row_index[row] = i
+            obj._columns.append(new)
+            obj.contigs[new.contig] = new
+        return(obj)
+
+    @staticmethod
+    def _sort_rows(rows, starts, stops):
+        '''
+        Sort rows by start and stop, keeping the input order of ties. The rows
+        are sorted by stop, then stably by start, so each sort keys on a
+        single int rather than on a tuple per row.
+        '''
+        rows = sorted(rows, key=stops.__getitem__)
+        rows.sort(key=starts.__getitem__)
+        return(rows)
+
+    @staticmethod
+    def _is_sorted(rows, starts, stops):
+        # inputs are often already sorted on one side, skip sorting them
+        for a, b in zip(rows, itertools.islice(rows, 1, None)):
+            if (starts[a], stops[a]) > (starts[b], stops[b]):
+                return False
+        return True
+
+    def nbytes(self):
+        '''
+        The number of bytes held in the arrays of this set
+        '''
+        arrays = [self._row_contig, self._row_index]
+        for col in self._columns:
+            arrays += [col.starts, col.stops, col.rows]
+            if col.scores is not None:
+                arrays.append(col.scores)
+        return(sum(a.itemsize * len(a) for a in arrays))
+
+    @staticmethod
+    def pair(a, b):
+        '''
+        Link two sets built from the same rows, so that Block.over on either
+        side returns the matching block on the other.
+        '''
+        a.over, b.over = b, a
+
+    def __len__(self):
+        return(len(self._row_index))
+
+    def block(self, row):
+        '''
+        Get the block loaded from a given input row
+        '''
+        col = self._columns[self._row_contig[row]]
+        return(Block(col, self._row_index[row]))
+
+    def intervals(self):
+        for col in self.contigs.values():
+            for i in range(len(col)):
+                yield Block(col, i)
+
+    def scores(self):
+        return(itertools.chain.from_iterable(c.scores for c in self.contigs.values() if c.scores))
+
+    def _anchor_index(self, col, other):
+        # the last block that starts at or before the end of the query
+        i = bisect.bisect_right(col.starts, other.stop) - 1
+        return(self._nearest(col, i, other))
+
+    def _nearest(self, col, i, other):
+        '''
+        Given the last block i starting before the end of other, return the
+        block that anchors other. If block i is the only one overlapping other,
+        that is i. If several overlap, it is the one the binary search of
+        IntervalSet.anchor meets first (see _probe), so the anchor is the same
+        as with the linked sets. If none overlap, it is whichever of i and i+1
+        is closest.
+        '''
+        if i < 0:
+            return 0
+        reach = col.reach
+        if col.stops[i] >= other.start and (i == 0 or reach[i - 1] < other.start):
+            return i
+        if reach[i] >= other.start:
+            j = self._probe(col, other.start, other.stop)
+            if j is None:
+                # the search missed the overlapping blocks, e.g. ones nested
+                # inside a longer block
+                j = col.index.first_overlapping(other.start, other.stop)
+            return j
+        if i + 1 < len(col) and col.starts[i + 1] - other.stop < other.start - col.stops[i]:
+            return i + 1
+        return i
+
+    @staticmethod
+    def _probe(col, start, stop):
+        '''
+        The binary search of IntervalSet.anchor: the first block it meets that
+        overlaps [start, stop], or None if it meets none
+        '''
+        low, high = 0, len(col) - 1
+        if high == 0:
+            return 0
+        i = high // 2
+        # as max(ceil(log2(high - low)) + 1, 2)
+        for _ in range(max((high - low - 1).bit_length() + 1, 2)):
+            if stop < col.starts[i]:
+                high = i
+                i = high - (high - low + 1) // 2
+            elif start > col.stops[i]:
+                low = i
+                i = low + (high - low + 1) // 2
+            else:
+                return i
+        return None
+
+    def anchor(self, other):
+        '''
+        Returns an interval that overlaps other, or, if none are found, returns
+        the nearest adjacent block. Runs in log(n) time.
+        '''
+        try:
+            col = self.contigs[other.contig]
+        except KeyError:
+            return None
+        return(Block(col, self._anchor_index(col, other)))
+
+    def _anchor_groups(self, others):
+        '''
+        Find the anchors of a batch of intervals, yielding for each contig
+        the positions of its intervals in others, its ContigColumns and the
+        index of each anchor. The intervals of each contig are swept in order
+        of their ends, so each search only has to consider blocks past the
+        previous answer. Only the intervals that the last block starting
+        before their end is not the only one to overlap go through _nearest.
+        '''
+        order = sorted(range(len(others)), key=lambda k: (others[k].contig, others[k].stop))
+        for contig, group in itertools.groupby(order, key=lambda k: others[k].contig):
+            col = self.contigs.get(contig)
+            if col is None:
+                continue
+            ks = list(group)
+            last = []
+            reach = col.reach
+            lo = 0
+            for k in ks:
+                other = others[k]
+                lo = bisect.bisect_right(col.starts, other.stop, lo)
+                i = lo - 1
+                if i < 0 or col.stops[i] < other.start or (i > 0 and reach[i - 1] >= other.start):
+                    i = self._nearest(col, i, other)
+                last.append(i)
+            yield(ks, col, last)
+
+    def anchor_many(self, others):
+        '''
+        Anchor a batch of intervals, returning Blocks (or None) in the order
+        of the input
+        '''
+        others = list(others)
+        anchors = [None] * len(others)
+        for ks, col, last in self._anchor_groups(others):
+            for k, i in zip(ks, last):
+                anchors[k] = Block(col, i)
+        return(anchors)
+
+    def anchor_columns(self, others):
+        '''
+        Anchor a batch of intervals, returning the contig, start and stop of
+        each anchor as three lists in the order of the input, without making
+        a Block for each. The contig is None for intervals on contigs without
+        blocks.
+        '''
+        others = list(others)
+        contigs, starts, stops = [None] * len(others), [0] * len(others), [0] * len(others)
+        for ks, col, last in self._anchor_groups(others):
+            for k, i in zip(ks, last):
+                contigs[k] = col.contig
+                starts[k] = col.starts[i]
+                stops[k] = col.stops[i]
+        return(contigs, starts, stops)
+
+    def get_overlapping(self, bound, sort=True):
+        try:
+            col = self.contigs[bound.contig]
+        except KeyError:
+            return []
+        # blocks are already sorted by start and stop, so sort is a no-op
+        return([Block(col, i) for i in col.index.overlapping(bound.start, bound.stop)])
+
+    def iter_overlapping(self, bound):
+        '''
+        Lazily yield the blocks overlapping bound, in no particular order
+        '''
+        col = self.contigs.get(bound.contig)
+        if col is not None:
+            for i in col.index.iter_overlapping(bound.start, bound.stop):
+                yield Block(col, i)
@@ -0,0 +1,177 @@
+import argparse
+import collections
+import gzip
+import io
+import os
+import struct
+import sys
+import zlib
+
+from lib.util import err
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+def open_input(path, threads=None):
+    '''
+    Open a text input that may be gzip, bgzip or zstd compressed, which is
+    recognized from its first bytes rather than its name. '-' is stdin. Used
+    as an argparse type, so errors opening the file are reported as usage
+    errors, as argparse.FileType does.
+    '''
+    try:
+        if path == '-':
+            raw = sys.stdin.buffer
+        else:
+            raw = open(path, 'rb')
+    except OSError as e:
+        raise argparse.ArgumentTypeError("can't open '%s': %s" % (path, e))
+    if not hasattr(raw, 'peek'):
+        raw = io.BufferedReader(raw)
+    head = raw.peek(18)[:18]
+    if _is_bgzf(head):
+        binary = io.BufferedReader(BgzfReader(raw, threads=threads), buffer_size=1 << 20)
+    elif head.startswith(GZIP_MAGIC):
+        binary = gzip.GzipFile(fileobj=raw, mode='rb')
+    elif head.startswith(ZSTD_MAGIC):
+        binary = _open_zstd(raw)
+    else:
+        binary = raw
+    return(io.TextIOWrapper(binary))
+
+def _is_bgzf(head):
+    # a gzip member with an extra field whose first subfield is 'BC'
+    return(len(head) == 18 and head.startswith(GZIP_MAGIC) and head[3] & 4 and head[12:14] == b'BC')
+
+def _open_zstd(raw):
+    '''
+    Decompress with the zstandard package if it is installed, otherwise with
+    the zstd command
+    '''
+    try:
+        import zstandard
+    except ImportError:
+        zstandard = None
+    if zstandard is not None:
+        return(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    # imported here, as for threads below, so that plain inputs do not pay
+    # for them at startup
+    import shutil
+    import subprocess
+    import threading
+    if not shutil.which('zstd'):
+        err('Reading zstd input requires the zstandard package or the zstd command')
+    proc = subprocess.Popen(['zstd', '-dc'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    # feed the command from a thread, since some of the input has already
+    # been buffered to check its format
+    def feed():
+        with raw, proc.stdin:
+            shutil.copyfileobj(raw, proc.stdin)
+    threading.Thread(target=feed, daemon=True).start()
+    # keep the input's name, so the decompressed stream can still be cached
+    proc.stdout.raw.name = getattr(raw, 'name', None)
+    return(proc.stdout)
+
+class BgzfReader(io.RawIOBase):
+    '''
+    Read a bgzip (BGZF) file, inflating its blocks in parallel. BGZF is a
+    series of gzip members of at most 64 KB, each recording its compressed
+    size in its header, so blocks can be split off the file without inflating
+    them and handed to a pool of threads (zlib releases the GIL). Blocks are
+    read ahead, ahead blocks at a time, and returned in order.
+    '''
+    def __init__(self, fileobj, threads=None, ahead=256):
+        self._file = fileobj
+        self.name = getattr(fileobj, 'name', None)
+        self._ahead = ahead
+        import concurrent.futures
+        self._pool = concurrent.futures.ThreadPoolExecutor(threads or os.cpu_count() or 1)
+        self._start = fileobj.tell() if fileobj.seekable() else 0
+        self._reset()
+
+    def _reset(self):
+        self._pending = collections.deque()
+        self._eof = False
+        self._data = b''
+        self._offset = 0
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return(self._file.seekable())
+
+    def tell(self):
+        return(self._pos)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        '''
+        Seek to an uncompressed position. Seeking backwards rereads the file
+        from the start, as gzip does.
+        '''
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation('can only seek from the start or the current position')
+        if offset < self._pos:
+            self._file.seek(self._start)
+            self._reset()
+        while self._pos < offset:
+            if not self.read(min(offset - self._pos, 1 << 20)):
+                break
+        return(self._pos)
+
+    def readinto(self, b):
+        while self._offset == len(self._data):
+            self._fill()
+            if not self._pending:
+                return 0
+            self._data = self._pending.popleft().result()
+            self._offset = 0
+        n = min(len(b), len(self._data) - self._offset)
+        b[:n] = self._data[self._offset:self._offset + n]
+        self._offset += n
+        self._pos += n
+        return(n)
+
+    def _fill(self):
+        while not self._eof and len(self._pending) < self._ahead:
+            block = self._read_block()
+            if block is None:
+                self._eof = True
+            else:
+                self._pending.append(self._pool.submit(_inflate, *block))
+
+    def _read_block(self):
+        head = self._file.read(12)
+        if not head:
+            return None
+        if len(head) < 12 or not head.startswith(GZIP_MAGIC) or not head[3] & 4:
+            err("'%s' is not a valid bgzip file" % self.name)
+        xlen = struct.unpack('<H', head[10:12])[0]
+        extra = self._file.read(xlen)
+        bsize = None
+        i = 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == b'BC':
+                bsize = struct.unpack('<H', extra[i + 4:i + 6])[0] + 1
+            i += 4 + slen
+        if bsize is None:
+            err("'%s' is not a valid bgzip file" % self.name)
+        rest = self._file.read(bsize - 12 - xlen)
+        crc, isize = struct.unpack('<II', rest[-8:])
+        return(rest[:-8], crc, isize, self.name)
+
+    def close(self):
+        if not self.closed:
+            self._pool.shutdown(wait=False)
+            self._file.close()
+        super().close()
+
+def _inflate(data, crc, isize, name):
+    out = zlib.decompress(data, -15)
+    if len(out) != isize or zlib.crc32(out) != crc:
+        err("'%s' has a corrupt bgzip block" % name)
+    return(out)
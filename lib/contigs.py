@@ -0,0 +1,75 @@
+'''
+One table of contig names, shared by every input.
+
+The synteny, gff, hit and N-string loaders look each contig name up here as
+they load and keep its integer ID rather than the name, so contigs compare
+and hash as small ints, fit in 'i' arrays, and each name is held once however
+many intervals lie on it. IDs are numbered in the order names are first seen,
+which depends on the order the inputs are loaded, so they are never written
+out: names are looked up again only for output, and anything that orders
+contigs (e.g. the genes of a Genome) orders them by name.
+'''
+
+import array
+
+class Contigs:
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        '''
+        The ID of a contig name, numbering it if it is new
+        '''
+        try:
+            return(self.ids[name])
+        except KeyError:
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            return(self.ids[name])
+
+    def intern_all(self, names):
+        '''
+        The IDs of many contig names, as an array. New names are numbered
+        once each, then all names are looked up at once.
+        '''
+        names = list(names)
+        for name in dict.fromkeys(names):
+            if name not in self.ids:
+                self.ids[name] = len(self.names)
+                self.names.append(name)
+        return(array.array('i', map(self.ids.__getitem__, names)))
+
+    def name(self, contig):
+        return(self.names[contig])
+
+    def __len__(self):
+        return(len(self.names))
+
+# the table every loader uses
+TABLE = Contigs()
+
+def intern(name):
+    return(TABLE.intern(name))
+
+def intern_all(names):
+    return(TABLE.intern_all(names))
+
+def name(contig):
+    return(TABLE.names[contig])
+
+def label(contig):
+    '''
+    The name of a contig for printing. Contigs that are not IDs, such as the
+    gene names that are the contigs of hit queries, are already names.
+    '''
+    if isinstance(contig, int):
+        return(TABLE.names[contig])
+    return(contig)
+
+def names():
+    '''
+    The names of all IDs, indexed by ID. The list grows as more names are
+    interned.
+    '''
+    return(TABLE.names)
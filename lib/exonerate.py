@@ -1,10 +1,18 @@
-from lib.util import err
+import heapq
+import itertools
+import operator
+
+import lib.contigs as contigs
+from lib.util import err, read_blocks, split_columns
 from lib.intervals import Interval
 
 class Hit:
     '''
     The base class for hit objects. Contains the query interval, the target interval, and the score.
+    The target contig is kept as its ID in the shared table of lib.contigs.
     '''
+    __slots__ = ('name', 'gene', 'target', 'score')
+
     def __init__(self, row):
         self.name = row[0]
 
@@ -13,7 +21,7 @@ class Hit:
                                 start=int(row[1]),
                                 stop=int(row[2]))
 
-            self.target = Interval(contig=row[4],
+            self.target = Interval(contig=contigs.intern(row[4]),
                                 start=int(row[5]),
                                 stop=int(row[6]))
         except ValueError:
@@ -26,20 +34,32 @@ class Hit:
         except ValueError:
             err('the score column (9) must be numeric')
 
+    def fields(self):
+        '''
+        The values of the output columns of this hit
+        '''
+        return((self.gene.contig, self.gene.start, self.gene.stop,
+                contigs.name(self.target.contig), self.target.start, self.target.stop,
+                self.score))
+
     def __str__(self):
-        elements = (self.gene, self.target, self.score)
-        out = '\t'.join((str(x) for x in elements))
+        out = '\t'.join(map(str, self.fields()))
         return(out)
 
     def __eq__(self, other):
-        return all((self.target == other.target,
-                    self.score  == other.score,
-                    self.gene   == other.gene))
+        return (self.score  == other.score  and
+                self.target == other.target and
+                self.gene   == other.gene)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.gene, self.target, self.score))
+
 class IntronHit(Hit):
+    __slots__ = ('first_stop', 'has_frameshift', 'num_split_codons', 'num_intron', 'max_intron')
+
     def __init__(self, row):
         try:
             super().__init__(row[0:9])
@@ -58,32 +78,146 @@ class IntronHit(Hit):
         # try:
         #     self.intron_lengths
 
-    def __str__(self):
-        elements = (self.gene,
-                    self.target,
-                    self.score,
-                    self.first_stop,
-                    self.has_frameshift,
-                    self.num_split_codons,
-                    self.num_intron,
-                    self.max_intron)
-        out = '\t'.join((str(x) for x in elements))
-        return(out)
+    def fields(self):
+        return(super().fields() + (self.first_stop,
+                                   self.has_frameshift,
+                                   self.num_split_codons,
+                                   self.num_intron,
+                                   self.max_intron))
 
 class Exonerate:
     def __init__(self, _file):
         self._file = _file
 
-    def generator(self):
+    @classmethod
+    def from_rows(cls, ncol, rows):
+        '''
+        Make an Exonerate object that reads already split rows rather than a
+        file. ncol is the number of columns in the original header. If rows
+        can be iterated more than once, grouped() can check it in place.
+        '''
+        obj = cls(None)
+        obj._ncol = ncol
+        obj._rows = rows
+        return(obj)
+
+    def _read(self):
+        '''
+        Get the number of header columns and an iterator over split rows
+        '''
+        if self._file is None:
+            return(self._ncol, iter(self._rows))
         # skip the header
-        header = next(self._file).split('\t')
-        if(len(header) == 8):
-            for line in self._file:
-                row = line.split('\t')
+        ncol = len(next(self._file).split('\t'))
+        return(ncol, self._split_rows(self._file))
+
+    @staticmethod
+    def _split_rows(lines):
+        '''
+        Split the input on tabs into rows a block of text at a time. Blocks
+        with the same number of fields on every line are split at once and
+        regrouped into rows with zip, other blocks are split line by line.
+        '''
+        for text in read_blocks(lines):
+            width = len(text[:text.index('\n')].split('\t'))
+            columns = split_columns(text, width, sep='\t')
+            if columns is None:
+                rows = (line.split('\t') for line in text.splitlines())
+            else:
+                rows = zip(*columns)
+            for row in rows:
+                yield row
+
+    def _hits(self, ncol, rows):
+        if(ncol == 8):
+            for row in rows:
                 yield Hit(row=row)
-        elif(len(header) == 14):
-            for line in self._file:
-                row = line.split('\t')
+        elif(ncol == 14):
+            for row in rows:
                 yield IntronHit(row=row)
         else:
             err('Unrecognized hit input (incorrect number of columns)')
+
+    def generator(self):
+        return(self._hits(*self._read()))
+
+    def grouped(self, chunk_size=1000000):
+        '''
+        Yield the hits of one gene at a time, as lists. If all hits of each
+        gene are already adjacent, the input is streamed so only one gene is
+        held in memory. Otherwise it is first sorted by gene name, externally
+        in chunks of chunk_size rows, keeping the input order within a gene.
+        '''
+        if self._is_grouped():
+            hits = self.generator()
+        else:
+            hits = self._hits(*self._sorted_rows(chunk_size))
+        for name, group in itertools.groupby(hits, key=lambda h: h.name):
+            yield(list(group))
+
+    def _is_grouped(self):
+        '''
+        Scan the gene names, then rewind. Inputs that can not be rewound
+        (e.g. pipes) are reported as ungrouped.
+        '''
+        if self._file is None:
+            if iter(self._rows) is self._rows:
+                return False
+            names = (row[0] for row in self._rows)
+        else:
+            try:
+                start = self._file.tell()
+            except (AttributeError, OSError):
+                return False
+            next(self._file, None)
+            names = (line.split('\t', 1)[0] for line in self._file)
+
+        seen = set()
+        grouped = True
+        for name, _ in itertools.groupby(names):
+            if name in seen:
+                grouped = False
+                break
+            seen.add(name)
+
+        if self._file is not None:
+            self._file.seek(start)
+        return(grouped)
+
+    def _sorted_rows(self, chunk_size):
+        ncol, rows = self._read()
+        by_name = operator.itemgetter(0)
+        chunks = []
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            # the sort is stable, so hits of a gene stay in input order
+            chunk.sort(key=by_name)
+            chunks.append(chunk)
+            if len(chunks) > 1 or len(chunk) == chunk_size:
+                chunks[-1] = self._spill(chunk)
+        if len(chunks) == 1 and isinstance(chunks[0], list):
+            return(ncol, iter(chunks[0]))
+        return(ncol, self._merge_spilled(chunks, by_name))
+
+    @staticmethod
+    def _spill(chunk):
+        # only large unsorted inputs spill, so tempfile is imported here
+        import tempfile
+        f = tempfile.TemporaryFile('w+')
+        for row in chunk:
+            f.write('\t'.join(str(x) for x in row).rstrip('\n') + '\n')
+        f.seek(0)
+        return(f)
+
+    @staticmethod
+    def _merge_spilled(files, key):
+        # heapq.merge takes equal keys from earlier files first, which keeps
+        # the merge stable
+        try:
+            for row in heapq.merge(*((line.split('\t') for line in f) for f in files), key=key):
+                yield row
+        finally:
+            for f in files:
+                f.close()
@@ -1,30 +1,54 @@
 import collections
+import lib.contigs as contigs
 from lib.intervals import OrderedInterval, IntervalSet
 from lib.util import Tabular, err
 
 class Gene(OrderedInterval):
+    __slots__ = ('name',)
+
     def __init__(self, name, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.name = name
 
 class Genome(Tabular, IntervalSet):
+    ncol = 9
+
     def __init__(self, filename):
         Tabular.__init__(self, filename)
-        IntervalSet.__init__(self, self.genes)
+        IntervalSet.__init__(self, self.genes, names=contigs.names())
 
-    def _load_rows(self, rows):
-        try:
-            self.genes = (Gene(name=i, contig=a, start=int(d), stop=int(e)) for a,b,c,d,e,f,g,h,i in rows)
-        except IndexError:
-            err('GFF formated files must have 9 columns')
-        except ValueError:
-            err("Start and stop positions must be integers")
+    @classmethod
+    def from_genes(cls, genes):
+        '''
+        Make a Genome from already parsed Gene objects
+        '''
+        obj = cls.__new__(cls)
+        obj.genes = genes
+        IntervalSet.__init__(obj, genes, names=contigs.names())
+        return(obj)
+
+    def _load_columns(self, chunks):
+        '''
+        Load the genes, with their contig names as IDs in the shared table of
+        lib.contigs
+        '''
+        self.genes = []
+        for a,b,c,d,e,f,g,h,i in chunks:
+            try:
+                starts, stops = list(map(int, d)), list(map(int, e))
+            except ValueError:
+                err("Start and stop positions must be integers")
+            self.genes.extend(Gene(name=n, contig=c, start=x, stop=y)
+                              for n, c, x, y in zip(i, contigs.intern_all(a), starts, stops))
 
     def _missing_input_error(self):
         err('GFF file is missing or unreadable')
 
+    def _column_count_error(self):
+        err('GFF formated files must have 9 columns')
+
     def __str__(self):
-        rows = ((g.name, g.contig, str(g.start), str(g.stop)) for g in self.intervals())
+        rows = ((g.name, contigs.name(g.contig), str(g.start), str(g.stop)) for g in self.intervals())
         out = '\n'.join(['\t'.join(x) for x in rows])
         return(out)
 
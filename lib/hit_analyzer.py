@@ -1,10 +1,91 @@
+import array
+import itertools
+import operator
+
+from lib.exonerate import IntronHit
+from lib.profiler import NullProfiler
+from lib.util import err
+
 class HitAnalyzer:
     '''
     This class contains the algorithms to compare results and logically trim bad hits
+
+    The kept hits of all results are laid out as column arrays, each rule is
+    applied to whole columns at once, and the hits passing every rule are
+    then split back among their results. Rules left as None are not applied,
+    so by default every hit is kept. The frameshift, stop codon and intron
+    rules need the 14 column hit format:
+
+        min_score         - drop hits scoring below this
+        no_frameshift     - drop hits with a frameshift
+        no_premature_stop - drop hits with a stop codon before the end of the
+                            aligned query (first_stop is the query position of
+                            the first stop, 0 if there is none)
+        max_intron        - drop hits with an intron longer than this
     '''
-    def __init__(self):
-        pass
+    def __init__(self, min_score=None, no_frameshift=False, no_premature_stop=False, max_intron=None,
+                 profiler=None):
+        self.min_score = min_score
+        self.no_frameshift = no_frameshift
+        self.no_premature_stop = no_premature_stop
+        self.max_intron = max_intron
+        self.profiler = profiler or NullProfiler()
 
+    def rules(self):
+        '''
+        The rules in use, by name
+        '''
+        rules = {
+            'min_score'         : self.min_score,
+            'no_frameshift'     : self.no_frameshift or None,
+            'no_premature_stop' : self.no_premature_stop or None,
+            'max_intron'        : self.max_intron
+        }
+        return({k: v for k, v in rules.items() if v is not None})
 
     def filter(self, results):
-        pass
+        results = [r for r in results if r.hits]
+        hits = list(itertools.chain.from_iterable(r.hits for r in results))
+        keep = self.mask(hits)
+        if keep is None:
+            return
+        start = 0
+        for result in results:
+            stop = start + len(result.hits)
+            result.hits = list(itertools.compress(result.hits, keep[start:stop]))
+            result.hit_set = set(result.hits)
+            start = stop
+
+    def mask(self, hits):
+        '''
+        Whether each hit passes every rule, as a list of booleans, or None if
+        there are no rules. The number of hits failing each rule is counted.
+        '''
+        rules = self.rules()
+        if not rules:
+            return None
+        intron = [k for k in rules if k != 'min_score']
+        if intron and hits and not isinstance(hits[0], IntronHit):
+            err('Filtering hits on %s requires the 14 column hit format' % ', '.join(intron))
+
+        column = lambda name, typecode='q': array.array(typecode, map(operator.attrgetter(name), hits))
+        passes = {}
+        if self.min_score is not None:
+            passes['min_score'] = map(operator.ge, column('score', 'd'), itertools.repeat(self.min_score))
+        if self.no_frameshift:
+            passes['no_frameshift'] = map(operator.not_, column('has_frameshift'))
+        if self.no_premature_stop:
+            # no stop, or one past the aligned query
+            first_stop = column('first_stop')
+            passes['no_premature_stop'] = map(operator.or_,
+                map(operator.le, first_stop, itertools.repeat(0)),
+                map(operator.ge, first_stop, column('gene.stop')))
+        if self.max_intron is not None:
+            passes['max_intron'] = map(operator.le, column('max_intron'), itertools.repeat(self.max_intron))
+
+        passes = {k: list(v) for k, v in passes.items()}
+        keep = list(map(all, zip(*passes.values())))
+        counts = {'hits failing %s' % k: len(v) - sum(v) for k, v in passes.items()}
+        counts['hits filtered'] = len(keep) - sum(keep)
+        self.profiler.count(counts)
+        return(keep)
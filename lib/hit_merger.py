@@ -1,41 +1,139 @@
+import bisect
+import collections
+import itertools
 import sys
 import lib.intervals as intervals
+from lib.profiler import NullProfiler
+
+class FlankTargets:
+    '''
+    The target intervals of the syntenic blocks in a gene's query flanks. They
+    are stored as sorted start and stop arrays per target contig, so the number
+    of blocks overlapping any target interval is found with two bisections:
+    those starting before the interval ends, less those ending before it
+    starts.
+    '''
+    def __init__(self, blocks):
+        starts = collections.defaultdict(list)
+        stops = collections.defaultdict(list)
+        for block in blocks:
+            target = block.over
+            starts[target.contig].append(target.start)
+            stops[target.contig].append(target.stop)
+        self.starts = {k: sorted(v) for k, v in starts.items()}
+        self.stops = {k: sorted(v) for k, v in stops.items()}
+
+    def count_overlapping(self, bound):
+        return(self.count(bound.contig, bound.start, bound.stop))
+
+    def count(self, contig, start, stop):
+        try:
+            starts = self.starts[contig]
+            stops = self.stops[contig]
+        except KeyError:
+            return 0
+        return(bisect.bisect_right(starts, stop) - bisect.bisect_left(stops, start))
 
 class HitMerger:
-    def __init__(self, flank_width, min_neighbors, target_flank_ratio, quiet=False):
+    def __init__(self, flank_width, min_neighbors, target_flank_ratio, quiet=False, profiler=None,
+                 nstrings=None, max_n_fraction=0.5):
         self.flank_width = flank_width
         self.min_neighbors = min_neighbors
         self.target_flank_ratio = target_flank_ratio
+        # if the N runs of the target are given, hits that are more than
+        # max_n_fraction N are dropped
+        self.nstrings = nstrings
+        self.max_n_fraction = max_n_fraction
         self.quiet = quiet
+        self.profiler = profiler or NullProfiler()
 
     def merge(self, result, hit, syn):
         '''
         Input one hit from an exonerate output.
         '''
-        assert(hit.name == result.name)
+        self.merge_all(result=result, hits=(hit,), syn=syn)
 
-        result.total_hits += 1
-
-        anchor = syn.anchor_target(hit.target)
-
-        # If no blocks map to the specified target contig, stop
-        if not anchor:
-            if not self.quiet:
-                msg = "%s is on a contig with no syntenic blocks: %s"
-                print(msg % (result.gene.name, str(hit.target)), file=sys.stderr)
-            return False
-
-        # stop if this hit already exists
-        for h in result.hits:
-            if h == hit:
-                return True
+    def merge_all(self, result, hits, syn, anchors=None):
+        '''
+        Input all hits of one gene from an exonerate output. The syntenic
+        blocks in the gene's query flanks are gathered once, on the first hit
+        that needs them, and every hit is then scored against them.
 
-        # Define the interval in which to search for neighbors in the target
-        target_flanks = intervals.Interval(
-            contig=anchor.contig,
-            start=max(0, anchor.start - self.target_flank_ratio * self.flank_width),
-            stop=(anchor.stop + self.target_flank_ratio * self.flank_width))
+        The anchors of the hit targets are looked up in one batch (see
+        Synteny.anchor_targets), unless they are given as the contig, start
+        and stop lists that returns, e.g. from a batch over many genes.
+        '''
+        total, in_gaps, no_synteny, duplicate, kept = 0, 0, 0, 0, 0
+        hits = list(hits)
+        if anchors is None:
+            anchors = syn.anchor_targets([hit.target for hit in hits])
+        anchor_contigs, anchor_starts, anchor_stops = anchors
+        margin = self.target_flank_ratio * self.flank_width
+        if self.nstrings is not None:
+            n_fractions = self.nstrings.fractions([hit.target for hit in hits])
+        for i, hit in enumerate(hits):
+            assert(hit.name == result.name)
+
+            result.total_hits += 1
+            total += 1
 
+            # drop hits that mostly fall in assembly gaps
+            if self.nstrings is not None and n_fractions[i] > self.max_n_fraction:
+                in_gaps += 1
+                continue
+
+            # If no blocks map to the specified target contig, stop
+            contig = anchor_contigs[i]
+            if contig is None:
+                if not self.quiet:
+                    msg = "%s is on a contig with no syntenic blocks: %s"
+                    print(msg % (result.gene.name, str(hit.target)), file=sys.stderr)
+                no_synteny += 1
+                continue
+
+            # stop if this hit already exists
+            if self._is_duplicate(result, hit):
+                duplicate += 1
+                continue
+
+            # Define the interval in which to search for neighbors in the
+            # target, truncated to integers as an Interval would be
+            start = int(max(0, anchor_starts[i] - margin))
+            stop = int(anchor_stops[i] + margin)
+
+            # === my hacky first order solution ===
+
+            # I simply count the number of nearby (by an arbitrary cutoff) blocks
+            # that map to a region near the target interval. If there are more than
+            # a certain number, I keep the exonerate hit.
+
+            matching = self.flank_targets(result).count(contig, start, stop)
+
+            if matching >= self.min_neighbors:
+                result.hits.append(hit)
+                result.hit_set.add(hit)
+                kept += 1
+
+        if self.profiler.enabled:
+            self.profiler.count({
+                'hits'                              : total,
+                'target anchor lookups'             : total,
+                'hits in target gaps'               : in_gaps,
+                'hits on contigs without synteny'   : no_synteny,
+                'hits duplicate'                    : duplicate,
+                'hits kept'                         : kept,
+                'hits dropped for too few neighbors': total - in_gaps - no_synteny - duplicate - kept
+            })
+
+    def _is_duplicate(self, result, hit):
+        return(hit in result.hit_set)
+
+    def flank_targets(self, result):
+        '''
+        The FlankTargets of the blocks in a gene's query flanks, which hits
+        are scored against. They are gathered on first use and kept on the
+        result, with the query flanks and the index ranges of their blocks.
+        '''
         # If the query flanks have not yet been measured, do so
         if not result.query_flanks:
             result.query_flanks = intervals.Interval(
@@ -43,26 +141,33 @@ class HitMerger:
                 start=max(0, result.gene.start - self.flank_width),
                 stop=(result.gene.stop + self.flank_width))
 
-        # === my hacky first order solution ===
-
-        # I simply count the number of nearby (by an arbitrary cutoff) blocks
-        # that map to a region near the target interval. If there are more than
-        # a certain number, I keep the exonerate hit.
+        if result.flank_ranges is None:
+            result.flank_ranges = self._get_flank_ranges(result)
 
-        matching, total = (0, 0)
-        a, b = (result.lower, result.upper)
-
-        while intervals.overlaps(result.query_flanks, a):
-            total += 1
-            matching += intervals.overlaps(target_flanks, a.over)
-            a = a.last
+        if result.flank_targets is None:
+            col = result.columns
+            blocks = [col.block(i) for i in itertools.chain(*(range(*r) for r in result.flank_ranges))]
+            self.profiler.observe('query flank blocks', len(blocks))
+            result.flank_targets = FlankTargets(blocks)
+        return(result.flank_targets)
 
-        while intervals.overlaps(result.query_flanks, b):
-            total += 1
-            matching += intervals.overlaps(target_flanks, b.over)
-            b = b.next
+    def _get_flank_ranges(self, result):
+        '''
+        Walk outwards from the blocks bordering the gene until one falls
+        outside the query flanks, returning the index ranges of the blocks
+        passed below and above the gene
+        '''
+        if result.columns is None:
+            return(((0, 0), (0, 0)))
+        starts, stops, flanks = result.columns.starts, result.columns.stops, result.query_flanks
+        overlaps = lambda i: starts[i] <= flanks.stop and stops[i] >= flanks.start
 
-        if matching >= self.min_neighbors:
-            result.hits.append(hit)
+        a = b = result.lower.index + 1 if result.lower else 0
+        while a > 0 and overlaps(a - 1):
+            a -= 1
 
+        c = d = result.upper.index if result.upper else len(starts)
+        while d < len(starts) and overlaps(d):
+            d += 1
 
+        return(((a, b), (c, d)))
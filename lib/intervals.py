@@ -1,7 +1,12 @@
+import array
+import bisect
 import collections
 import itertools
 import math
 
+import lib.contigs as contigs
+from lib.util import err
+
 def allequal(x):
     return(len(set(x)) == 1)
 
@@ -36,6 +41,8 @@ def get_following(ordint, n):
             break
 
 class Interval:
+    __slots__ = ('contig', 'start', 'stop')
+
     def __init__(self, contig, start, stop):
         try:
             self.contig = contig
@@ -45,28 +52,127 @@ class Interval:
             err('The start and stop positions of an interval must be integers')
 
     def __str__(self):
-        return('\t'.join((self.contig, str(self.start), str(self.stop))))
+        return('\t'.join((contigs.label(self.contig), str(self.start), str(self.stop))))
 
     def __eq__(self, other):
-        return all((self.start  == other.start,
-                    self.stop   == other.stop,
-                    self.contig == other.contig))
+        return (self.start  == other.start and
+                self.stop   == other.stop  and
+                self.contig == other.contig)
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash((self.contig, self.start, self.stop))
+
+class IntervalIndex:
+    '''
+    An overlap index over intervals sorted by start. The intervals are split
+    into bins of similar length (each bin spans a factor of four), and every
+    bin keeps its own sorted start and stop arrays. An interval in a bin whose
+    longest member is L can only overlap [start, stop] if it starts within
+    [start - L, stop], so each bin is searched with two bisections followed by
+    a scan over candidates that mostly do overlap. Long intervals therefore
+    never hide the short ones nested inside them (or vice versa), and a query
+    costs O(b * log(n) + k) for b bins and k overlapping intervals.
+    '''
+    def __init__(self, starts, stops):
+        groups = collections.defaultdict(list)
+        for i, (start, stop) in enumerate(zip(starts, stops)):
+            groups[(stop - start).bit_length() // 2].append(i)
+        self.bins = []
+        for key in sorted(groups):
+            idx = groups[key]
+            self.bins.append((
+                max(stops[i] - starts[i] for i in idx),
+                array.array('q', (starts[i] for i in idx)),
+                array.array('q', (stops[i] for i in idx)),
+                array.array('q', idx)
+            ))
+
+    def overlapping(self, start, stop):
+        '''
+        Get the indices of all intervals overlapping [start, stop], in
+        increasing order
+        '''
+        found = []
+        for longest, starts, stops, idx in self.bins:
+            lo = bisect.bisect_left(starts, start - longest)
+            hi = bisect.bisect_right(starts, stop, lo)
+            found.extend(idx[i] for i in range(lo, hi) if stops[i] >= start)
+        if len(self.bins) > 1:
+            found.sort()
+        return(found)
+
+    def iter_overlapping(self, start, stop):
+        '''
+        Lazily yield the indices of the intervals overlapping [start, stop],
+        bin by bin rather than in increasing order. Cheaper than overlapping
+        when only the first few matches may be needed.
+        '''
+        for longest, starts, stops, idx in self.bins:
+            lo = bisect.bisect_left(starts, start - longest)
+            hi = bisect.bisect_right(starts, stop, lo)
+            for i in range(lo, hi):
+                if stops[i] >= start:
+                    yield idx[i]
+
+    def first_overlapping(self, start, stop):
+        '''
+        Get the index of the first interval overlapping [start, stop], or None
+        '''
+        first = None
+        for longest, starts, stops, idx in self.bins:
+            lo = bisect.bisect_left(starts, start - longest)
+            hi = bisect.bisect_right(starts, stop, lo)
+            for i in range(lo, hi):
+                if stops[i] >= start:
+                    if first is None or idx[i] < first:
+                        first = idx[i]
+                    break
+        return(first)
+
 class IntervalSet:
-    def __init__(self, intervals):
-        intervals = sorted(intervals, key = lambda x: (x.contig, x.start, x.stop))
+    def __init__(self, intervals, names=None):
+        '''
+        If names is given, the contigs of the intervals are IDs into it (see
+        lib.contigs), and are ordered by name rather than by ID.
+
+        Neighbouring intervals are linked through next and last. Intervals
+        with no room for the links (e.g. plain slotted Intervals) are left
+        unlinked, so get_preceding and get_following yield nothing for them.
+        '''
+        if names is None:
+            key = lambda x: (x.contig, x.start, x.stop)
+        else:
+            key = lambda x: (names[x.contig], x.start, x.stop)
+        intervals = sorted(intervals, key=key)
         self.contigs = collections.defaultdict(list)
         for interval in intervals:
             self.contigs[interval.contig].append(interval)
-        for group in self.contigs.values():
+        linked = all(isinstance(x, OrderedInterval) or hasattr(x, '__dict__') for x in intervals)
+        for group in self.contigs.values() if linked else ():
             prior = group[0]
             for this in group[1:]:
                 prior.next = this
                 this.last = prior
                 prior = this
+        self._indices = {}
+
+    def index(self, contig):
+        '''
+        Get the IntervalIndex of a contig, building it on first use
+        '''
+        try:
+            return self._indices[contig]
+        except KeyError:
+            con = self.contigs[contig]
+            index = IntervalIndex(
+                starts = array.array('q', (x.start for x in con)),
+                stops  = array.array('q', (x.stop  for x in con))
+            )
+            self._indices[contig] = index
+            return(index)
 
     def intervals(self):
         for interval in itertools.chain(*self.contigs.values()):
@@ -114,23 +220,19 @@ class IntervalSet:
             return this
 
     def get_overlapping(self, bound, sort=True):
-        anchor = self.anchor(bound)
-        if not overlaps(anchor, bound):
+        '''
+        Get all intervals that overlap bound. Since intervals are stored
+        sorted, the result is always ordered by start and stop.
+        '''
+        if bound.contig not in self.contigs:
             return []
-        overlapping = [anchor]
-        q = anchor.last
-        while q and overlaps(bound, q):
-            overlapping.append(q)
-            q = q.last
-        q = anchor.next
-        while q and overlaps(bound, q):
-            overlapping.append(q)
-            q = q.next
-        if sort:
-            overlapping = sorted(overlapping, key=lambda x: (x.start, x.stop))
-        return(overlapping)
+        con = self.contigs[bound.contig]
+        index = self.index(bound.contig)
+        return([con[i] for i in index.overlapping(bound.start, bound.stop)])
 
 class OrderedInterval(Interval):
+    __slots__ = ('last', 'next')
+
     def __init__(self, last=None, next=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.last = last
@@ -144,6 +246,8 @@ class OrderedInterval(Interval):
         del obj
 
 class MappedInterval(OrderedInterval):
+    __slots__ = ('over', 'score')
+
     def __init__(self, over=None, score=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.over = over
@@ -1,12 +1,89 @@
+import array
+import bisect
+import collections
+import lib.contigs as contigs
 import lib.util as util
+from lib.util import err
 
 class NStrings(util.Tabular):
-    def _assign_colnames(self, columns):
+    '''
+    The runs of N (assembly gaps) in the target genome, given as contig,
+    start (indexed from 0) and length. Once loaded, the runs of each contig
+    are merged into sorted, disjoint gaps with a running total of their
+    lengths, so the number of N bases in any interval is found with two
+    bisections, whatever the number of gaps it spans. Contigs are given by
+    their IDs in the shared table of lib.contigs.
+    '''
+    ncol = 3
+
+    def _load_columns(self, chunks):
+        self.chr = array.array('i')
+        self.start = array.array('q')
+        self.length = array.array('q')
+        for chr, start, length in chunks:
+            self.chr.extend(contigs.intern_all(chr))
+            try:
+                self.start.extend(map(int, start))
+                self.length.extend(map(int, length))
+            except ValueError:
+                err('in Nstrings file, columns 2 and 3 must be counting numbers')
+        self._build_gaps()
+
+    def _build_gaps(self):
+        '''
+        For each contig, the starts and (exclusive) stops of the merged gaps,
+        and the number of N bases before each gap
+        '''
+        runs = collections.defaultdict(list)
+        for contig, start, length in zip(self.chr, self.start, self.length):
+            if length > 0:
+                runs[contig].append((start, start + length))
+        self.gaps = {}
+        for contig, pairs in runs.items():
+            pairs.sort()
+            starts, stops, before = array.array('q'), array.array('q'), array.array('q', [0])
+            for start, stop in pairs:
+                if stops and start <= stops[-1]:
+                    stops[-1] = max(stops[-1], stop)
+                else:
+                    starts.append(start)
+                    stops.append(stop)
+            for start, stop in zip(starts, stops):
+                before.append(before[-1] + stop - start)
+            self.gaps[contig] = (starts, stops, before)
+
+    def count(self, contig, start, stop):
+        '''
+        The number of N bases in the interval from start to stop, inclusive
+        '''
         try:
-            self.chr = columns[0]
-            self.start = tuple(int(i) for i in columns[1])
-            self.length = tuple(int(i) for i in columns[2])
-        except IndexError:
-            err('NStrings file must have 3 columns: chr_name, start, and length')
-        except ValueError:
-            err('in Nstrings file, columns 2 and 3 must be counting numbers')
+            starts, stops, before = self.gaps[contig]
+        except KeyError:
+            return 0
+        stop += 1
+        # gaps i to j-1 overlap the interval
+        i = bisect.bisect_right(stops, start)
+        j = bisect.bisect_left(starts, stop, i)
+        if i == j:
+            return 0
+        # less the parts of the end gaps that stick out of the interval
+        return(before[j] - before[i] - max(0, start - starts[i]) - max(0, stops[j - 1] - stop))
+
+    def fraction(self, interval):
+        '''
+        The fraction of an interval that is N
+        '''
+        return(self.count(interval.contig, interval.start, interval.stop) / max(1, interval.stop - interval.start + 1))
+
+    def fractions(self, intervals):
+        '''
+        The fraction of each of many intervals that is N, as an array
+        '''
+        count = self.count
+        return(array.array('d', (count(x.contig, x.start, x.stop) / max(1, x.stop - x.start + 1) for x in intervals)))
+
+    def _missing_input_error(self):
+        err('N-string file is missing or unreadable')
+
+    def _column_count_error(self):
+        err('NStrings file must have 3 columns: chr_name, start, and length')
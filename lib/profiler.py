@@ -0,0 +1,102 @@
+import collections
+import contextlib
+import json
+import time
+
+class Profiler:
+    '''
+    Collects per-stage timings and counters for the --profile report.
+    Components take a profiler and report in bulk (once per gene or stage),
+    so the no-op NullProfiler used by default costs almost nothing. Counts
+    that take work to gather are only gathered if enabled is true.
+    '''
+    enabled = True
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.counters = collections.Counter()
+        self.per_gene = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stage['wall'] += time.perf_counter() - wall
+            stage['cpu'] += time.process_time() - cpu
+
+    def count(self, counts):
+        '''
+        Add a dict of counts to the counters
+        '''
+        self.counters.update(counts)
+
+    def observe(self, name, value):
+        '''
+        Record a per-gene value, keeping its count, total and maximum
+        '''
+        try:
+            summary = self.per_gene[name]
+        except KeyError:
+            summary = self.per_gene[name] = {'genes': 0, 'total': 0, 'max': value}
+        summary['genes'] += 1
+        summary['total'] += value
+        summary['max'] = max(summary['max'], value)
+
+    def take(self):
+        '''
+        Remove and return the counters and per-gene values, e.g. to send them
+        from a worker process back to the parent, see merge
+        '''
+        taken = (self.counters, self.per_gene)
+        self.counters = collections.Counter()
+        self.per_gene = collections.OrderedDict()
+        return(taken)
+
+    def merge(self, taken):
+        counters, per_gene = taken
+        self.counters.update(counters)
+        for name, other in per_gene.items():
+            summary = self.per_gene.setdefault(name, {'genes': 0, 'total': 0, 'max': other['max']})
+            summary['genes'] += other['genes']
+            summary['total'] += other['total']
+            summary['max'] = max(summary['max'], other['max'])
+
+    def report(self):
+        per_gene = collections.OrderedDict()
+        for name, s in self.per_gene.items():
+            per_gene[name] = dict(s, mean=s['total'] / s['genes'])
+        return(collections.OrderedDict((
+            ('stages', self.stages),
+            ('counters', collections.OrderedDict(sorted(self.counters.items()))),
+            ('per_gene', per_gene)
+        )))
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+            f.write('\n')
+
+class NullProfiler:
+    '''
+    A profiler that records nothing
+    '''
+    enabled = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield
+
+    def count(self, counts):
+        pass
+
+    def observe(self, name, value):
+        pass
+
+    def take(self):
+        return None
+
+    def merge(self, taken):
+        pass
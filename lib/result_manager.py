@@ -1,28 +1,163 @@
+import collections
+import itertools
+
+import lib.state as state
+from lib.profiler import NullProfiler
+from lib.util import err, can_fork, fork_map
+
 class ResultManager:
-    def __init__(self, gen, syn, exo, syn_merger, hit_merger, hit_analyzer):
+    def __init__(self, gen, syn, exo, syn_merger, hit_merger, hit_analyzer, jobs=1, profiler=None,
+                 reuse=None, keep_state=False):
+        self.profiler = profiler or NullProfiler()
         self.results = {g.name: Result(g) for g in gen.intervals()}
+        params = state.parameters(syn_merger, hit_merger, hit_analyzer, syn=syn)
+        digests = {}
 
-        # merge in the synteny data
-        for result in self.results.values():
-            syn_merger.merge(result=result, syn=syn)
+        if reuse is not None:
+            with self.profiler.stage('reuse'):
+                hits = self._merge_reused(syn, exo, hit_merger, reuse, params, digests)
+        elif jobs > 1 and can_fork():
+            hits = self._merge_parallel(syn, exo, syn_merger, hit_merger, jobs)
+        else:
+            hits = self._merge_serial(syn, exo, syn_merger, hit_merger)
+
+        if hit_analyzer is not None:
+            with self.profiler.stage('HitAnalyzer'):
+                hit_analyzer.filter(self.results.values())
+
+        # the state refers to each gene's hits, so it is taken while they are at hand
+        self.state = state.State.from_results(self.results.values(), hits, params, digests) if keep_state else None
 
-        # merge in the exonerate hit data
+    def _get_result(self, hit):
+        try:
+            return self.results[hit.name]
+        except KeyError:
+            err('The gene %s in the hit file is missing from the gff file' % hit.name)
+
+    def _group_hits(self, exo):
+        # the hits of each gene, in hit file order
+        hits = collections.defaultdict(list)
         for hit in exo.generator():
-            try:
-                hit_merger.merge(result=self.results[hit.name], hit=hit, syn=syn)
-            except KeyError:
-                err('The gene {} in the hit file is missing from the gff file' % hit.name)
+            hits[self._get_result(hit)].append(hit)
+        return(hits)
+
+    def _merge_serial(self, syn, exo, syn_merger, hit_merger):
+        with self.profiler.stage('SynMerger'):
+            self._merge_synteny(syn, syn_merger)
+        with self.profiler.stage('HitMerger'):
+            return(self._merge_hits(syn, exo, hit_merger))
 
-        # hit_analyzer.filter(self.results)
+    def _merge_synteny(self, syn, syn_merger):
+        syn_merger.merge_all(results=self.results.values(), syn=syn)
+
+    def _merge_hits(self, syn, exo, hit_merger):
+        # merge in the exonerate hit data, one gene at a time
+        hits = self._group_hits(exo)
+        _merge_gene_hits(hit_merger, syn, hits)
+        return(hits)
+
+    def _merge_reused(self, syn, exo, hit_merger, saved, params, digests):
+        '''
+        Restore the SynMerger state of every gene from an earlier run (see
+        lib.state), and the kept hits of genes whose hits and hit parameters
+        are unchanged. Only the hits of the other genes are merged again. The
+        digests of the hits are added to digests, by result.
+        '''
+        hits = self._group_hits(exo)
+        same_flanks = params['hit-flank-width'] == saved.meta['params']['hit-flank-width']
+        reused = 0
+        changed = {}
+        for result in self.results.values():
+            i = saved.set_synteny(result, syn)
+            gene_hits = hits.get(result)
+            if not gene_hits:
+                continue
+            if same_flanks:
+                result.flank_ranges = saved.flank_ranges(i)
+            digests[result] = state.hits_digest(gene_hits)
+            kept = saved.kept(i, params, gene_hits, digests[result])
+            if kept is None:
+                changed[result] = gene_hits
+            else:
+                result.total_hits = len(gene_hits)
+                result.hits = kept
+                result.hit_set = set(kept)
+                reused += 1
+        _merge_gene_hits(hit_merger, syn, changed)
+        self.profiler.count({'genes with reused hits': reused})
+        return(hits)
+
+    def _merge_parallel(self, syn, exo, syn_merger, hit_merger, jobs):
+        '''
+        Genes on different query contigs are independent, so each contig is
+        merged in its own task. Workers are forked, inheriting the synteny
+        index and the partitioned genes and hits rather than receiving them
+        pickled. They return only per-gene state, with blocks given by their
+        synteny row and kept hits by their position in the contig's hit list,
+        which is then applied to the results here in the serial order.
+        '''
+        genes = collections.defaultdict(list)
+        for result in self.results.values():
+            genes[result.gene.contig].append(result)
+        gene_hits = self._group_hits(exo)
+        hits = collections.defaultdict(list)
+        for result, rhits in gene_hits.items():
+            hits[result.gene.contig].extend(rhits)
+
+        # start the largest contigs first to balance the workers
+        contigs = sorted(genes, key=lambda c: len(genes[c]) + len(hits[c]), reverse=True)
+
+        shared = (syn, syn_merger, hit_merger, genes, hits)
+        with self.profiler.stage('parallel merge'):
+            for contig, states, counts in fork_map(_merge_contig, shared, contigs, jobs, ordered=False):
+                for result, gene_state in zip(genes[contig], states):
+                    result.set_state(gene_state, syn=syn, hits=hits[contig])
+                for taken in counts:
+                    self.profiler.merge(taken)
+        return(gene_hits)
 
     def get(self, name):
         return self.results[name]
 
-    def write(self):
-        for r in self.results.values():
-            s = str(r)
-            if s:
-                print(s)
+    def write(self, writer):
+        writer.write(list(self.results.values()))
+
+class StreamingResultManager:
+    '''
+    Merges and writes results one gene at a time instead of holding a Result
+    for every gene. Hits are read grouped by gene (see Exonerate.grouped), and
+    each gene is written as soon as its group ends, so output follows the
+    order of genes in the hit file rather than in the gff file.
+    '''
+    def __init__(self, gen, syn, exo, syn_merger, hit_merger, hit_analyzer, profiler=None):
+        self.profiler = profiler or NullProfiler()
+        self.genes = {g.name: g for g in gen.intervals()}
+        self.syn = syn
+        self.exo = exo
+        self.syn_merger = syn_merger
+        self.hit_merger = hit_merger
+        self.hit_analyzer = hit_analyzer
+
+    def results(self):
+        # the stages are interleaved, so only the combined time is reported
+        with self.profiler.stage('streaming merge'):
+            for result in self._results():
+                yield result
+
+    def _results(self):
+        for hits in self.exo.grouped():
+            try:
+                result = Result(self.genes[hits[0].name])
+            except KeyError:
+                err('The gene %s in the hit file is missing from the gff file' % hits[0].name)
+            self.syn_merger.merge(result=result, syn=self.syn)
+            self.hit_merger.merge_all(result=result, hits=hits, syn=self.syn)
+            if self.hit_analyzer is not None:
+                self.hit_analyzer.filter((result,))
+            yield result
+
+    def write(self, writer):
+        writer.write(self.results())
 
 class Result:
     '''
@@ -38,16 +173,114 @@ class Result:
         self.is_simple  = False
         self.lower = None # the block downstream of the last homologous block
         self.upper = None # the block upstream of the last homologous block
+        # the ContigColumns of the gene's query contig, and (start, stop)
+        # index ranges into it of the blocks overlapping the gene and of the
+        # context blocks
+        self.columns = None
+        self.links = None
+        self.context = None
+        # the fraction of the target between lower and upper that is N, if
+        # the N runs of the target are given
+        self.target_n_fraction = None
 
         # --- variables set by HitMerger ---
         # -------------------------------------------
         # declaration of an interval containing the flanks around the gene
         # in the query
         self.query_flanks = None
+        # the index ranges of the blocks within query_flanks, below and above
+        # the gene, and the target side of those blocks
+        self.flank_ranges = None
+        self.flank_targets = None
         self.total_hits = 0
         self.hits = []
+        # the kept hits again, for constant time duplicate checks
+        self.hit_set = set()
+
+    def get_state(self, hits):
+        '''
+        Get the merged state as plain values. Blocks are replaced by their
+        synteny row and kept hits by their index in hits.
+        '''
+        index = {id(h): i for i, h in enumerate(hits)}
+        row = lambda block: None if block is None else block.row
+        return((self.is_present,
+                self.is_simple,
+                row(self.lower),
+                row(self.upper),
+                None if self.columns is None else self.columns.contig,
+                self.links,
+                self.context,
+                self.target_n_fraction,
+                self.query_flanks,
+                self.flank_ranges,
+                self.total_hits,
+                [index[id(h)] for h in self.hits]))
+
+    def set_state(self, state, syn, hits):
+        '''
+        Restore the state returned by get_state
+        '''
+        block = lambda row: None if row is None else syn.query.block(row)
+        (self.is_present,
+            self.is_simple,
+            lower,
+            upper,
+            contig,
+            self.links,
+            self.context,
+            self.target_n_fraction,
+            self.query_flanks,
+            self.flank_ranges,
+            self.total_hits,
+            kept) = state
+        self.lower, self.upper = block(lower), block(upper)
+        self.columns = None if contig is None else syn.query.contigs[contig]
+        self.hits = [hits[i] for i in kept]
+        self.hit_set = set(self.hits)
+
+    def copy_synteny(self, other):
+        '''
+        Take the state set by SynMerger from another result for the same gene
+        '''
+        self.is_present, self.is_simple = other.is_present, other.is_simple
+        self.lower, self.upper = other.lower, other.upper
+        self.columns, self.links, self.context = other.columns, other.links, other.context
+        self.target_n_fraction = other.target_n_fraction
 
     def __str__(self):
         # out = '\t'.join((self.gene.name, str(self.is_present), str(self.is_simple)))
         out = '\n'.join([str(h) for h in self.hits])
         return(out)
+
+def _merge_gene_hits(hit_merger, syn, gene_hits):
+    '''
+    Merge the hits of many genes, given as lists by result. The targets of
+    all the hits are anchored in one batch, rather than gene by gene.
+    '''
+    hits = list(itertools.chain.from_iterable(gene_hits.values()))
+    contigs, starts, stops = syn.anchor_targets([hit.target for hit in hits])
+    i = 0
+    for result, rhits in gene_hits.items():
+        j = i + len(rhits)
+        anchors = (contigs[i:j], starts[i:j], stops[i:j])
+        hit_merger.merge_all(result=result, hits=rhits, syn=syn, anchors=anchors)
+        i = j
+
+def _merge_contig(shared, contig):
+    '''
+    Merge the genes and hits of one query contig in a forked worker
+    '''
+    syn, syn_merger, hit_merger, genes, hits = shared
+    # only report what this task counts back to the parent
+    profilers = {id(p): p for p in (syn_merger.profiler, hit_merger.profiler)}.values()
+    for profiler in profilers:
+        profiler.take()
+    by_name = {r.name: r for r in genes[contig]}
+    syn_merger.merge_all(results=genes[contig], syn=syn)
+    gene_hits = collections.defaultdict(list)
+    for hit in hits[contig]:
+        gene_hits[by_name[hit.name]].append(hit)
+    _merge_gene_hits(hit_merger, syn, gene_hits)
+    states = [r.get_state(hits[contig]) for r in genes[contig]]
+    return(contig, states, [p.take() for p in profilers])
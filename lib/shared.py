@@ -0,0 +1,74 @@
+'''
+A synteny index shared by concurrent fagin runs.
+
+`fagin serve --shared NAME` loads the synteny once and writes it, in the cache
+layout (see lib.cache), to a file in shared memory (/dev/shm, where there is
+one). It then stays resident until it is interrupted or terminated, and
+removes the file on the way out. Runs given --shared NAME map that file
+read-only instead of reading a synteny file, as they would a cache file, so
+any number of them hold one copy of the index between them and none parses
+the synteny.
+'''
+
+import os
+import signal
+import sys
+import tempfile
+
+import lib.cache as cache
+from lib.util import err
+
+def directory():
+    if os.path.isdir('/dev/shm'):
+        return('/dev/shm')
+    return(tempfile.gettempdir())
+
+def path(name):
+    '''
+    The file a synteny index shared as name is kept in
+    '''
+    if not name or os.sep in name:
+        err("'%s' is not a valid name for a shared index" % name)
+    return(os.path.join(directory(), 'fagin.%s.fidx' % name))
+
+def publish(syn, name, stamp=None):
+    '''
+    Share a synteny index as name, returning the path of its file. The file
+    is written under a temporary name and then renamed, so runs never see
+    it half written.
+    '''
+    target = path(name)
+    if os.path.exists(target):
+        err("A synteny index is already shared as '%s' (%s)" % (name, target))
+    cache.save(target, 'synteny', stamp, syn)
+    return(target)
+
+def withdraw(name):
+    try:
+        os.remove(path(name))
+    except FileNotFoundError:
+        pass
+
+def attach(name):
+    '''
+    Map the synteny index shared as name
+    '''
+    header, syn = cache.open_saved(path(name), 'synteny')
+    if syn is None:
+        err("No synteny index is shared as '%s', start one with `fagin serve --shared %s`" % (name, name))
+    return(syn)
+
+def serve(name):
+    '''
+    Keep the index published as name shared until SIGINT or SIGTERM, then
+    withdraw it
+    '''
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        print("Sharing the synteny index as '%s' (%s), interrupt to stop" % (name, path(name)), file=sys.stderr)
+        while True:
+            signal.pause()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        withdraw(name)
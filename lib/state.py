@@ -0,0 +1,177 @@
+'''
+The merge state of every gene, saved in the output directory of a run made
+with --save-state.
+
+A later run on the same synteny, gff and N-string files, given that output directory
+with --reuse, restores the SynMerger state of every gene instead of
+recomputing it, and only merges the hits of genes whose hits changed. The
+hits of a gene are recognized by a digest of their fields.
+
+The state is a file in the cache layout (see lib.cache) of kind 'state', with
+one row per gene in gff order. Blocks are given by their synteny row and kept
+hits by their index among the gene's hits, in hit file order. The header
+records the merge parameters and the stamps of the synteny, gff and N-string
+files.
+'''
+
+import array
+import hashlib
+import os
+
+import lib.cache as cache
+import lib.contigs as contigs
+from lib.util import err
+
+FILENAME = 'state.fidx'
+
+# stands for a missing fraction in the target_n column
+_NONE = -1.0
+
+def parameters(syn_merger, hit_merger, hit_analyzer=None, syn=None):
+    '''
+    The merge parameters, by option name
+    '''
+    return({
+        'min-syn-score'          : None if syn is None else syn.min_score,
+        'syn-context-width'      : syn_merger.width,
+        'hit-flank-width'        : hit_merger.flank_width,
+        'hit-min-neighbors'      : hit_merger.min_neighbors,
+        'hit-target-flank-ratio' : hit_merger.target_flank_ratio,
+        'max-n-fraction'         : None if hit_merger.nstrings is None else hit_merger.max_n_fraction,
+        'hit-filter'             : None if hit_analyzer is None else hit_analyzer.rules()
+    })
+
+def _inputs(gen_file, syn_file, nstr_file):
+    return((('genome', gen_file), ('synteny', syn_file), ('nstrings', nstr_file)))
+
+def sources(gen_file, syn_file, nstr_file=None):
+    '''
+    Stamps of the gff, synteny and N-string inputs, None for those that are
+    not given or not regular files
+    '''
+    paths = {k: handle and cache.source_path(handle) for k, handle in _inputs(gen_file, syn_file, nstr_file)}
+    return({k: cache.source_stamp(p) if p else None for k, p in paths.items()})
+
+def hits_digest(hits):
+    h = hashlib.blake2b(digest_size=8)
+    h.update(''.join('\t'.join(map(str, hit.fields())) + '\n' for hit in hits).encode())
+    return(int.from_bytes(h.digest(), 'little', signed=True))
+
+class State:
+    '''
+    Per-gene state columns, either built from merged results or read back
+    from a saved state file
+    '''
+    def __init__(self, meta, columns):
+        self.meta = meta
+        self.columns = columns
+        self.genes = {name: i for i, name in enumerate(meta['genes'])}
+
+    @classmethod
+    def from_results(cls, results, hits, params, digests=None):
+        '''
+        Take the state of results, given the hits of each result as a dict,
+        and optionally the digests of those hits already computed
+        '''
+        digests = digests or {}
+        results = list(results)
+        row = lambda block: -1 if block is None else block.row
+        names = {}
+        c = {k: array.array('q') for k in ('lower', 'upper', 'links', 'context', 'flank_ranges',
+                                           'digest', 'kept_offsets')}
+        c['target_n'] = array.array('d')
+        c['flags'] = array.array('b')
+        c['contig'] = array.array('i')
+        c['kept'] = array.array('i')
+        c['kept_offsets'].append(0)
+        for result in results:
+            c['flags'].append(result.is_present | result.is_simple << 1)
+            c['lower'].append(row(result.lower))
+            c['upper'].append(row(result.upper))
+            if result.columns is None:
+                c['contig'].append(-1)
+            else:
+                name = contigs.name(result.columns.contig)
+                c['contig'].append(names.setdefault(name, len(names)))
+            c['links'].extend(result.links or (-1, -1))
+            c['context'].extend(result.context or (-1, -1))
+            c['target_n'].append(_NONE if result.target_n_fraction is None else result.target_n_fraction)
+            if result.flank_ranges is None:
+                c['flank_ranges'].extend((-1, -1, -1, -1))
+            else:
+                c['flank_ranges'].extend(result.flank_ranges[0] + result.flank_ranges[1])
+            gene_hits = hits.get(result, ())
+            digest = digests.get(result)
+            c['digest'].append(hits_digest(gene_hits) if digest is None else digest)
+            index = {id(h): i for i, h in enumerate(gene_hits)}
+            c['kept'].extend(index[id(h)] for h in result.hits)
+            c['kept_offsets'].append(len(c['kept']))
+        meta = {'genes': [r.name for r in results], 'contigs': list(names), 'params': params}
+        return(cls(meta, c))
+
+    @classmethod
+    def load(cls, output_dir):
+        path = os.path.join(output_dir, FILENAME)
+        header, columns = cache.read(path)
+        if header is None or header['kind'] != 'state':
+            err("'%s' has no saved state from an earlier fagin run with --save-state" % output_dir)
+        meta = dict(header['meta'], sources=header['source'])
+        return(cls(meta, columns))
+
+    def write(self, output_dir, sources):
+        path = os.path.join(output_dir, FILENAME)
+        cache.write(path, 'state', sources, self.meta, {k: [v] for k, v in self.columns.items()})
+
+    def check(self, params, gen_file, syn_file, nstr_file=None):
+        '''
+        Exit unless the state was made from the same synteny, gff and
+        N-string files with the same synteny parameters, which are all
+        SynMerger depends on
+        '''
+        stamps = self.meta['sources']
+        for kind, handle in _inputs(gen_file, syn_file, nstr_file):
+            if kind == 'nstrings' and handle is None and stamps.get(kind) is None:
+                continue
+            path = handle and cache.source_path(handle)
+            if not (path and stamps.get(kind) and cache.is_current(stamps[kind], path)):
+                err('The %s file differs from the one the reused state was made from' % kind)
+        for name in ('min-syn-score', 'syn-context-width'):
+            if params[name] != self.meta['params'].get(name):
+                err('The reused state was made with a different --%s' % name)
+
+    def set_synteny(self, result, syn):
+        '''
+        Restore the SynMerger state of a result, returning the row of its
+        gene
+        '''
+        i = self.genes[result.name]
+        c = self.columns
+        block = lambda row: None if row < 0 else syn.query.block(row)
+        pair = lambda a: None if a[0] < 0 else (a[0], a[1])
+        result.is_present = bool(c['flags'][i] & 1)
+        result.is_simple = bool(c['flags'][i] & 2)
+        result.lower, result.upper = block(c['lower'][i]), block(c['upper'][i])
+        contig = c['contig'][i]
+        if contig < 0:
+            result.columns = None
+        else:
+            result.columns = syn.query.contigs[contigs.intern(self.meta['contigs'][contig])]
+        result.links = pair(c['links'][2 * i:2 * i + 2])
+        result.context = pair(c['context'][2 * i:2 * i + 2])
+        n = c['target_n'][i]
+        result.target_n_fraction = None if n == _NONE else n
+        return(i)
+
+    def kept(self, i, params, hits, digest):
+        '''
+        The hits kept for the gene in row i, if its hits (given with their
+        digest) and the hit parameters are unchanged, otherwise None
+        '''
+        c = self.columns
+        if params != self.meta['params'] or c['digest'][i] != digest:
+            return None
+        return([hits[k] for k in c['kept'][c['kept_offsets'][i]:c['kept_offsets'][i + 1]]])
+
+    def flank_ranges(self, i):
+        a, b, c, d = self.columns['flank_ranges'][4 * i:4 * i + 4]
+        return(None if a < 0 else ((a, b), (c, d)))
@@ -0,0 +1,173 @@
+import collections
+import itertools
+import os
+
+import lib.syn_merger as syn_merger
+import lib.hit_merger as hit_merger
+import lib.writer as writer
+from lib.result_manager import Result
+from lib.util import err, can_fork, fork_map
+
+# The parameters that can be swept, by their option name, with their type
+# and the short flag used to name output files
+PARAMETERS = collections.OrderedDict((
+    ('hit-flank-width',        (int,   'w')),
+    ('hit-min-neighbors',      (int,   'b')),
+    ('hit-target-flank-ratio', (float, 'r')),
+    ('syn-context-width',      (int,   'c'))
+))
+
+def parse_grid(items, defaults):
+    '''
+    Parse --grid arguments of the form 'hit-flank-width=10000,25000' into an
+    ordered dict of parameter values. Parameters that are not in the grid take
+    their single value from defaults, a dict keyed by parameter name. Values
+    are cast to the type of their parameter either way, so one setting always
+    gives one filename.
+    '''
+    grid = collections.OrderedDict((k, [PARAMETERS[k][0](defaults[k])]) for k in PARAMETERS)
+    for item in items or ():
+        name, _, values = item.partition('=')
+        if name not in PARAMETERS:
+            err("Cannot sweep '%s', choose from: %s" % (name, ', '.join(PARAMETERS)))
+        cast = PARAMETERS[name][0]
+        try:
+            grid[name] = [cast(v) for v in values.split(',')]
+        except ValueError:
+            err("The values of %s must be comma separated numbers, got '%s'" % (name, values))
+    return(grid)
+
+def combinations(grid):
+    '''
+    Every combination of the grid, as dicts keyed by parameter name
+    '''
+    return([collections.OrderedDict(zip(grid, values)) for values in itertools.product(*grid.values())])
+
+def filename(params, format='tsv'):
+    '''
+    The output file of one combination, named by the short flags of its
+    parameters, e.g. w25000_b3_r2.0_c10.tsv
+    '''
+    return('_'.join('%s%s' % (PARAMETERS[k][1], v) for k, v in params.items()) + writer.FORMATS[format])
+
+class Sweep:
+    '''
+    Evaluates every combination of a parameter grid on one set of loaded
+    inputs. Work that does not depend on a parameter is done once and shared:
+    hits are read and grouped by gene once, SynMerger runs once per context
+    width, and the query flank blocks of each gene are gathered once per
+    flank width. Only the hit filtering runs per combination, in forked
+    workers when jobs > 1, each writing its own output file.
+    '''
+    def __init__(self, gen, syn, exo, grid, jobs=1, quiet=False, format='tsv', nstrings=None, max_n_fraction=0.5,
+                 hit_analyzer=None):
+        self.gen = gen
+        self.syn = syn
+        self.hit_analyzer = hit_analyzer
+        self.nstrings = nstrings
+        self.max_n_fraction = max_n_fraction
+        self.grid = grid
+        self.jobs = jobs
+        self.quiet = quiet
+        self.format = format
+
+        genes = {g.name: g for g in gen.intervals()}
+        self.hits = collections.OrderedDict()
+        for hit in exo.generator():
+            if hit.name not in genes:
+                err('The gene %s in the hit file is missing from the gff file' % hit.name)
+            self.hits.setdefault(hit.name, []).append(hit)
+
+        # The anchors of the hit targets do not depend on any parameter, so
+        # they are looked up once, in one batch, and sliced out per gene
+        hits = list(itertools.chain.from_iterable(self.hits.values()))
+        contigs, starts, stops = syn.anchor_targets([hit.target for hit in hits])
+        self.anchors = {}
+        i = 0
+        for name, gene_hits in self.hits.items():
+            j = i + len(gene_hits)
+            self.anchors[name] = (contigs[i:j], starts[i:j], stops[i:j])
+            i = j
+
+        # SynMerger state per context width, as a list of results in gff order
+        self.synteny = {}
+        for width in grid['syn-context-width']:
+            merger = syn_merger.SynMerger(width=width, nstrings=nstrings)
+            results = [Result(g) for g in gen.intervals()]
+            merger.merge_all(results=results, syn=syn)
+            self.synteny[width] = results
+
+        # The lower and upper blocks of a gene do not depend on the context
+        # width, so the flanks can be taken from any of its results
+        any_width = next(iter(self.synteny.values()))
+        self.flanks = {}
+        for width in grid['hit-flank-width']:
+            merger = hit_merger.HitMerger(
+                flank_width        = width,
+                min_neighbors      = 0,
+                target_flank_ratio = 0
+            )
+            flanks = {}
+            for result in any_width:
+                if result.name in self.hits:
+                    targets = merger.flank_targets(result)
+                    flanks[result.name] = (result.query_flanks, result.flank_ranges, targets)
+                    result.query_flanks, result.flank_ranges, result.flank_targets = None, None, None
+            self.flanks[width] = flanks
+
+    def results(self, params):
+        '''
+        Merge the hits under one combination of parameters, returning the
+        results in gff order
+        '''
+        merger = hit_merger.HitMerger(
+            flank_width        = params['hit-flank-width'],
+            min_neighbors      = params['hit-min-neighbors'],
+            target_flank_ratio = params['hit-target-flank-ratio'],
+            quiet              = self.quiet,
+            nstrings           = self.nstrings,
+            max_n_fraction     = self.max_n_fraction
+        )
+        flanks = self.flanks[params['hit-flank-width']]
+        results = []
+        for merged in self.synteny[params['syn-context-width']]:
+            result = Result(merged.gene)
+            result.copy_synteny(merged)
+            hits = self.hits.get(result.name)
+            if hits:
+                result.query_flanks, result.flank_ranges, result.flank_targets = flanks[result.name]
+                merger.merge_all(result=result, hits=hits, syn=self.syn, anchors=self.anchors[result.name])
+            results.append(result)
+        if self.hit_analyzer is not None:
+            self.hit_analyzer.filter(results)
+        return(results)
+
+    def write(self, output_dir):
+        '''
+        Write one output file per combination into output_dir, returning the
+        paths in grid order. With N runs, the target N fraction of each gene
+        is written once, to writer.GAPS.
+        '''
+        tasks = [(params, os.path.join(output_dir, filename(params, self.format)))
+                 for params in combinations(self.grid)]
+        if self.nstrings is not None:
+            # the flanking blocks of a gene, and so its target gap, do not
+            # depend on any parameter
+            writer.write_gaps(os.path.join(output_dir, writer.GAPS), next(iter(self.synteny.values())))
+        if self.jobs > 1 and len(tasks) > 1 and can_fork():
+            for _ in fork_map(_write_combination, self, tasks, self.jobs, ordered=False):
+                pass
+        else:
+            for task in tasks:
+                self._write_one(*task)
+        return([path for params, path in tasks])
+
+    def _write_one(self, params, path):
+        with writer.open_writer(path, format=self.format) as out:
+            out.write(self.results(params))
+
+def _write_combination(sweeper, task):
+    '''
+    Write one combination in a forked worker
+    '''
+    sweeper._write_one(*task)
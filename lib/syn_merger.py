@@ -1,14 +1,47 @@
-import itertools
+import array
 import lib.intervals as intervals
+from lib.profiler import NullProfiler
+
+class TargetColumns:
+    '''
+    The target contig, start and stop of a run of query blocks, given by
+    their synteny rows, so the targets of any stretch of them are slices
+    '''
+    def __init__(self, rows, syn):
+        blocks = [syn.target.block(row) for row in rows]
+        self.contigs = array.array('i', (x.contig for x in blocks))
+        self.starts  = array.array('q', (x.start for x in blocks))
+        self.stops   = array.array('q', (x.stop  for x in blocks))
 
 class SynMerger:
-    def __init__(self, width):
+    def __init__(self, width, profiler=None, nstrings=None):
         self.width=width
+        self.profiler = profiler or NullProfiler()
+        # the N runs of the target, if given, are used to measure how much of
+        # the target between the flanking blocks is assembly gap
+        self.nstrings = nstrings
 
     def merge(self, result, syn):
         self._syntenic_analysis(result=result, syn=syn)
 
-    def _syntenic_analysis(self, result, syn):
+    def merge_all(self, results, syn):
+        '''
+        Merge many genes at once. The genes are swept along each query contig
+        in order of their ends, so each anchor search only considers blocks
+        past the previous anchor (see Synteny.anchor_queries). The targets of
+        every query block are looked up once per contig rather than once per
+        gene whose context holds them. Neighbouring genes often share a
+        context, where genes are denser than blocks, and then share the test
+        of whether it is simple.
+        '''
+        results = list(results)
+        anchors = syn.anchor_queries([r.gene for r in results])
+        simple = {}
+        targets = {}
+        for result, anchor in zip(results, anchors):
+            self._syntenic_analysis(result=result, syn=syn, anchor=anchor, simple=simple, targets=targets)
+
+    def _syntenic_analysis(self, result, syn, anchor=None, simple=None, targets=None):
         '''
         Analyzes the synteny data, setting the following variables
         1. is_present - does at least one syntenic block overlap the query gene?
@@ -16,76 +49,148 @@ class SynMerger:
               target contig and do they all map to the query region?
         3. lower - an internal variable storing the first non-overlapping block before the gene
         4. upper - an internal variable storing the first non-overlapping block after the gene
+        5. links, context - the index ranges of the blocks overlapping the
+              gene and of its context, in the arrays of its query contig
+        6. target_n_fraction - if N runs are given, the fraction of the
+              target between the targets of lower and upper that is N
+
+        The anchor of the gene is looked up unless given. If simple is given,
+        it caches is_simple by context, and if targets is given, it caches the
+        TargetColumns of each query contig.
         '''
-        anchor = syn.anchor_query(result.gene)
+        if anchor is None:
+            anchor = syn.anchor_query(result.gene)
         if anchor:
-            links = self._get_links(result=result, anchor=anchor)
-            result.lower, result.upper = self._get_flanks(result=result, links=links, anchor=anchor)
+            # the blocks near the gene are kept as index ranges into the
+            # arrays of its query contig
+            result.columns = syn.query.contigs[anchor.contig]
+            result.links = self._get_links(result=result, anchor=anchor)
+            result.lower, result.upper = self._get_flanks(result=result, anchor=anchor)
 
-            context = self._get_context(result=result, links=links)
+            result.context = self._get_context(result=result)
+
+            if self.nstrings is not None:
+                result.target_n_fraction = self._get_target_n_fraction(result=result)
 
             # does the gene overlap a syntenic block?
-            result.is_present = bool(links)
+            result.is_present = result.links[0] < result.links[1]
 
             # are the upstream and downstream blocks in order on the same
             # chromosome?
-            result.is_simple = self._get_is_simple(anchor=anchor, context=context, syn=syn)
+            if targets is None:
+                aligned = None
+            else:
+                contig = result.columns.contig
+                if contig not in targets:
+                    targets[contig] = TargetColumns(result.columns.rows, syn)
+                aligned = targets[contig]
+            if simple is None:
+                result.is_simple = self._get_is_simple(anchor=anchor, result=result, syn=syn, aligned=aligned)
+            else:
+                key = (result.columns.contig, result.context, anchor.over.contig)
+                if key not in simple:
+                    simple[key] = self._get_is_simple(anchor=anchor, result=result, syn=syn, aligned=aligned)
+                result.is_simple = simple[key]
+
+            self.profiler.observe('context blocks', len(range(*result.context)))
+
+        if self.profiler.enabled:
+            self.profiler.count({
+                'genes'                            : 1,
+                'query anchor lookups'             : 1,
+                'genes on contigs without synteny' : int(not anchor),
+                'genes present'                    : int(result.is_present),
+                'genes simple'                     : int(result.is_simple)
+            })
 
     def _get_links(self, result, anchor):
         '''
-        find contiguous synteny blocks in the query that all overlap gene
+        find the range of contiguous synteny blocks in the query that all overlap gene
         '''
-        m = anchor
-        links = []
-        while m and intervals.overlaps(m, result.gene):
-            links.append(m)
-            m = m.last
-        m = anchor.next
-        while m and intervals.overlaps(m, result.gene):
-            links.append(m)
-            m = m.next
-        links = sorted(links, key=lambda x: (x.start, x.stop))
-        return(links)
-
-    def _get_flanks(self, result, links, anchor):
+        starts, stops, gene = result.columns.starts, result.columns.stops, result.gene
+        overlaps = lambda i: starts[i] <= gene.stop and stops[i] >= gene.start
+        lo = hi = anchor.index + 1
+        if overlaps(anchor.index):
+            lo -= 1
+            while lo > 0 and overlaps(lo - 1):
+                lo -= 1
+        while hi < len(starts) and overlaps(hi):
+            hi += 1
+        return((lo, hi))
+
+    def _get_flanks(self, result, anchor):
         '''
         Get the syntenic blocks flanking (but not overlapping) the gene
         '''
-        if not links:
+        lo, hi = result.links
+        if lo == hi:
             if result.gene.stop < anchor.start:
-                lower, upper = (anchor.last, anchor)
+                lower, upper = (anchor.index - 1, anchor.index)
             else:
-                lower, upper = (anchor, anchor.next)
+                lower, upper = (anchor.index, anchor.index + 1)
         else:
-            lower, upper = (links[0].last, links[-1].next)
-        return((lower, upper))
+            lower, upper = (lo - 1, hi)
+        return((result.columns.block(lower), result.columns.block(upper)))
+
+    def _get_context(self, result):
+        '''
+        get the range of syntenic blocks that overlap the gene along with the WIDTH blocks up and down stream
+        '''
+        n = len(result.columns)
+        k = max(self.width - 1, 0)
+        lower = result.lower.index if result.lower else -1
+        upper = result.upper.index if result.upper else n
+        return((max(0, lower - k), min(n, upper + 1 + k)))
 
-    def _get_context(self, result, links):
+    def _get_target_n_fraction(self, result):
         '''
-        get all syntenic blocks that overlap the gene along with the WIDTH blocks up and down stream
+        A gene missing from the target may just fall in an assembly gap. If
+        both flanking blocks map to one target contig, return the fraction of
+        the target between them that is N, otherwise None.
         '''
-        lower_context = intervals.get_preceding(result.lower, self.width - 1)
-        upper_context = intervals.get_following(result.upper, self.width - 1)
-        everything = itertools.chain(lower_context, [result.lower], links, [result.upper], upper_context)
-        return([x for x in everything if x])
+        if not (result.lower and result.upper):
+            return None
+        lower, upper = result.lower.over, result.upper.over
+        if lower.contig != upper.contig:
+            return None
+        # the blocks may map in either orientation
+        start = min(lower.stop, upper.stop) + 1
+        stop = max(lower.start, upper.start) - 1
+        if start > stop:
+            return(0.0)
+        return(self.nstrings.count(lower.contig, start, stop) / (stop - start + 1))
+
+    def _get_is_simple(self, anchor, result, syn, aligned=None):
+        '''
+        aligned holds the TargetColumns of the whole query contig, if they
+        are cached, otherwise those of the context are looked up
+        '''
+        col = result.columns
+        a, b = result.context
+        t, u = a, b
+        if aligned is None:
+            aligned, t, u = TargetColumns(col.rows[a:b], syn), 0, b - a
 
-    def _get_is_simple(self, anchor, context, syn):
         # are all the intervals on the same contig?
-        all_on_same_contig = intervals.allequal((x.over.contig for x in context))
+        all_on_same_contig = intervals.allequal(aligned.contigs[t:u])
 
         # make an interval describing the start and stop of the query context
-        qminstart = min(x.start for x in context)
-        qmaxstop  = max(x.stop  for x in context)
-        tminstart = min(x.over.start for x in context)
-        tmaxstop  = max(x.over.stop  for x in context)
+        qminstart = min(col.starts[a:b])
+        qmaxstop  = max(col.stops[a:b])
+        tminstart = min(aligned.starts[t:u])
+        tmaxstop  = max(aligned.stops[t:u])
         query_bound  = intervals.Interval(contig=anchor.contig, start=qminstart, stop=qmaxstop)
         target_bound = intervals.Interval(contig=anchor.over.contig, start=tminstart, stop=tmaxstop)
         has_outer = False
-        for q in syn.target.get_overlapping(target_bound):
+        checked = 0
+        # only the first target block mapping outside the query bound is
+        # needed, so the overlapping blocks are not all collected
+        for q in syn.target.iter_overlapping(target_bound):
+            checked += 1
             if not intervals.overlaps(query_bound, q.over):
                 has_outer = True
                 break
+        self.profiler.observe('target blocks checked', checked)
 
         is_simple = all_on_same_contig and not has_outer
         return(is_simple)
-
@@ -1,9 +1,19 @@
+import array
 import itertools
-from lib.intervals import MappedInterval, IntervalSet
+import operator
+import lib.contigs as contigs
+from lib.columnar import ColumnarIntervalSet
 from lib.util import Tabular, err
 
 class Synteny(Tabular):
-    def _load_rows(self, rows):
+    ncol = 8
+
+    def __init__(self, tab_data=None, rows=None, validate=True, min_score=None):
+        # blocks scoring below min_score are dropped as they are loaded
+        self.min_score = min_score
+        super().__init__(tab_data=tab_data, rows=rows, validate=validate)
+
+    def _load_columns(self, chunks):
         '''
         Load the synteny file. This file must have the following columns:
             0. query scaffold
@@ -15,37 +25,101 @@ class Synteny(Tabular):
             6. proportion identity (0 <= x <= 1)
             7. orientation (+/-)
         All start and stop locations are indexed from 0.
+
+        The rows arrive in column chunks (see Tabular), which are converted
+        in bulk into typed column arrays, less the rows scoring below
+        min_score if it is given. Contig names become IDs in the shared
+        table of lib.contigs. The columns then become a pair of
+        ColumnarIntervalSets, which share row numbers so each query block
+        maps over to its target.
+        '''
+        qcon, tcon = array.array('i'), array.array('i')
+        qstart, qstop, tstart, tstop = (array.array('q') for _ in range(4))
+        scores = array.array('d')
+
+        for a,b,c,d,e,f,g,h in chunks:
+            try:
+                # convert to appropriate types
+                qstart.extend(map(int, b))
+                qstop.extend(map(int, c))
+                tstart.extend(map(int, e))
+                tstop.extend(map(int, f))
+                scores.extend(map(float, g))
+            except ValueError:
+                err('Columns 1,2,4,5 of the synteny file must be integers, column 6 must be numeric')
+            qcon.extend(contigs.intern_all(a))
+            tcon.extend(contigs.intern_all(d))
+        # drop the fields of the last chunk before the indices are built
+        a = b = c = d = e = f = g = h = None
+
+        if self.min_score is not None:
+            keep = bytes(map(operator.ge, scores, itertools.repeat(self.min_score)))
+            qcon, tcon, qstart, qstop, tstart, tstop, scores = (
+                array.array(x.typecode, itertools.compress(x, keep))
+                for x in (qcon, tcon, qstart, qstop, tstart, tstop, scores))
+
+        names = contigs.names()
+        self.query = ColumnarIntervalSet.from_columns(qcon, qstart, qstop, scores, names=names)
+        # free each side's raw columns as soon as its index is built
+        del qcon, qstart, qstop
+        self.target = ColumnarIntervalSet.from_columns(tcon, tstart, tstop, scores, names=names)
+        ColumnarIntervalSet.pair(self.query, self.target)
+
+    @classmethod
+    def from_sets(cls, query, target):
+        '''
+        Make a Synteny object from already built query and target sets
         '''
-        try:
-            # convert to appropriate types
-            qint = [MappedInterval(contig=a, start=int(b), stop=int(c)) for a,b,c,d,e,f,g,h in rows]
-            tint = [MappedInterval(contig=d, start=int(e), stop=int(f)) for a,b,c,d,e,f,g,h in rows]
-            scores = [float(g) for a,b,c,d,e,f,g,h in rows]
-        except IndexError:
-            err('Synteny block file must have 8 columns')
-        except ValueError:
-            err('Columns 1,2,4,5 of the synteny file must be integers, column 6 must be numeric')
-
-        for q,t,s in zip(qint, tint, scores):
-            q.over, t.over = t, q
-            t.score, q.score = s, s
-        self.query, self.target = IntervalSet(qint), IntervalSet(tint)
+        obj = cls.__new__(cls)
+        obj.min_score = None
+        obj.query, obj.target = query, target
+        ColumnarIntervalSet.pair(query, target)
+        return(obj)
 
     def _validate_data(self):
-        if not all(0 <= b.score <= 1 for b in itertools.chain(self.query.intervals(), self.target.intervals())):
+        if not all(0 <= s <= 1 for s in self.query.scores()):
             err('In synteny file, proportion identity column (column 7) must be between 0 and 1')
 
     def _missing_input_error(self):
         err('Synteny file is missing or unreadable')
 
+    def _column_count_error(self):
+        err('Synteny block file must have 8 columns')
+
     def anchor_query(self, interval):
         return(self.query.anchor(interval))
 
     def anchor_target(self, interval):
         return(self.target.anchor(interval))
 
+    def anchor_queries(self, intervals):
+        '''
+        Anchor many intervals in the query at once, in input order
+        '''
+        return(self.query.anchor_many(intervals))
+
+    def anchor_targets(self, intervals):
+        '''
+        Anchor many intervals (e.g. the targets of hits) in the target at
+        once, returning the contig, start and stop of their anchors as three
+        lists in input order (see ColumnarIntervalSet.anchor_columns)
+        '''
+        return(self.target.anchor_columns(intervals))
+
     def cut_low_score_pairs(self, minscore):
-        for interval in self.query:
-            if interval.score < minscore:
-                interval.remove()
+        '''
+        Drop the blocks scoring below minscore. The rows to keep are found
+        from the score columns of the query side, then both sides are rebuilt
+        from them at once (see ColumnarIntervalSet.select) and paired again,
+        so later lookups never see the dropped blocks.
+        '''
+        keep = bytearray(len(self.query))
+        for col in self.query.contigs.values():
+            passed = itertools.compress(col.rows, map(operator.ge, col.scores, itertools.repeat(minscore)))
+            for row in passed:
+                keep[row] = 1
+        self.query = self.query.select(keep)
+        self.target = self.target.select(keep)
+        ColumnarIntervalSet.pair(self.query, self.target)
+        self.min_score = minscore if self.min_score is None else max(self.min_score, minscore)
 
@@ -1,27 +1,167 @@
+import itertools
 import sys
 
+# the function and state of the running fork_map, inherited by its workers
+_forked = None
+
 def err(msg):
     sys.exit(msg)
 
+def can_fork():
+    '''
+    Whether workers can be forked, as fork_map needs
+    '''
+    # multiprocessing is slow to import, so it is only imported when asked
+    import multiprocessing
+    return('fork' in multiprocessing.get_all_start_methods())
+
+def fork_map(func, shared, tasks, jobs, ordered=True):
+    '''
+    Yield func(shared, task) for each task, computed by jobs forked workers.
+    The workers inherit shared from this process rather than receiving it
+    pickled, so only the tasks and their results are passed between them.
+    Results are yielded in task order, or as they finish if not ordered.
+    '''
+    global _forked
+    import multiprocessing
+    _forked = (func, shared)
+    try:
+        with multiprocessing.get_context('fork').Pool(jobs) as pool:
+            run = pool.imap if ordered else pool.imap_unordered
+            for result in run(_call_forked, tasks):
+                yield result
+    finally:
+        _forked = None
+
+def _call_forked(task):
+    func, shared = _forked
+    return(func(shared, task))
+
+def read_blocks(tab_data, size=1 << 20, lines=10000):
+    '''
+    Yield the input as blocks of whole lines of text. Files are read about
+    size characters at a time, any other iterable of lines is joined lines at
+    a time. Every block ends in a newline.
+    '''
+    if hasattr(tab_data, 'read'):
+        while True:
+            text = tab_data.read(size)
+            if not text:
+                break
+            if text[-1] != '\n':
+                text += tab_data.readline()
+                if text[-1] != '\n':
+                    text += '\n'
+            yield text
+    else:
+        tab_data = iter(tab_data)
+        while True:
+            chunk = list(itertools.islice(tab_data, lines))
+            if not chunk:
+                break
+            yield '\n'.join(s.rstrip('\n') for s in chunk) + '\n'
+
+def split_columns(text, ncol, sep=None):
+    '''
+    Split a block of lines into ncol columns of fields in one call. Fields
+    are separated by whitespace, or by sep if it is given. Each newline is
+    first marked with a NUL field, so the split keeps the line breaks and
+    every line can be checked to hold exactly ncol fields: the marks must all
+    fall at every (ncol + 1)th field. Otherwise (comments, blank lines, ragged
+    rows, NULs in the text) None is returned and the block must be split line
+    by line.
+    '''
+    nlines = text.count('\n')
+    if '\0' in text:
+        return None
+    if sep is None:
+        fields = text.replace('\n', ' \0\n').split()
+    else:
+        # the block ends in a newline, whose mark is followed by an empty field
+        fields = text.replace('\n', sep + '\0' + sep).split(sep)
+        fields.pop()
+    if len(fields) != (ncol + 1) * nlines or fields[ncol::ncol + 1].count('\0') != nlines:
+        return None
+    return([fields[j::ncol + 1] for j in range(ncol)])
+
 class Tabular:
+    '''
+    Base class of the tabular input parsers. A subclass that sets ncol is
+    read in bulk: blocks of text are split at once into column chunks, each
+    a list of ncol column sequences, which are passed to _load_columns.
+    Other subclasses get the split rows of the input in _load_rows.
+    '''
+    # the number of columns per row, for bulk loading
+    ncol = None
+    # the number of rows per column chunk, when loading from rows
+    chunk_size = 10000
+
     def __init__(self, tab_data=None, rows=None, validate=True):
         if not tab_data and not rows:
             self._missing_input_error()
-        elif tab_data and not rows:
+        elif self.ncol is None:
+            self._load_rows(rows if rows else self._read_rows(tab_data))
+        elif rows:
+            self._load_columns(self._row_chunks(rows))
+        else:
+            self._load_columns(self._read_columns(tab_data))
+        if validate:
+            self._validate_data()
+
+    def _read_rows(self, tab_data):
+        '''
+        Lazily split the lines of the input, skipping comments. Rows are only
+        read as the loader consumes them, so the whole file is never held in
+        memory as text. Loaders are responsible for checking row lengths.
+        '''
+        try:
+            lines = iter(tab_data)
+        except TypeError:
+            self._missing_input_error()
+        return((s.split() for s in lines if s[0] != '#'))
+
+    def _read_columns(self, tab_data):
+        '''
+        Read the input as column chunks. Blocks are split with split_columns;
+        blocks that can not be split at once, or that contain a comment, fall
+        back to being split line by line, where row lengths are checked.
+        '''
+        if not hasattr(tab_data, 'read'):
             try:
-                rows = tuple(s.split() for s in tab_data if s[0] != '#')
+                tab_data = iter(tab_data)
             except TypeError:
                 self._missing_input_error()
-        self._load_rows(rows)
-        if validate:
-            self._validate_row_lengths(rows)
-            self._validate_data()
+        for text in read_blocks(tab_data, lines=self.chunk_size):
+            columns = None if '#' in text else split_columns(text, self.ncol)
+            if columns is None:
+                yield self._transpose(s.split() for s in text.splitlines() if s[:1] != '#')
+            else:
+                yield columns
+
+    def _row_chunks(self, rows):
+        '''
+        Transpose already split rows into column chunks of chunk_size rows
+        '''
+        rows = iter(rows)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            yield self._transpose(chunk)
 
-    def _validate_row_lengths(self, rows):
-        lengths = [len(s) for s in rows]
-        all_equal_length = all([i == lengths[0] for i in lengths])
-        if not all_equal_length:
-            msg = 'Unequal rows of unequal length in synteny file'
+    def _transpose(self, rows):
+        rows = list(rows)
+        if any(len(row) != self.ncol for row in rows):
+            self._column_count_error()
+        if not rows:
+            return [[] for _ in range(self.ncol)]
+        return(list(zip(*rows)))
+
+    def _load_columns(self, chunks):
+        raise NotImplemented
+
+    def _column_count_error(self):
+        raise NotImplemented
 
     def _validate_data(self):
         pass
@@ -0,0 +1,179 @@
+import collections
+
+from lib.util import err, can_fork, fork_map
+
+# lib.cache and lib.exonerate are imported by the writers that use them, so
+# that fagin can read FORMATS at startup without them
+
+# output formats and the extensions of their files
+FORMATS = collections.OrderedDict((
+    ('tsv',      '.tsv'),
+    ('columnar', '.fidx'),
+    ('parquet',  '.parquet')
+))
+
+# the file the target N fraction of each gene is written to, see GapWriter
+GAPS = 'target_gaps.tsv'
+
+def format_results(results):
+    '''
+    The kept hits of results as tab-separated lines
+    '''
+    return(''.join('\t'.join(map(str, hit.fields())) + '\n' for r in results for hit in r.hits))
+
+def format_gaps(results):
+    '''
+    The gene name and target N fraction (see SynMerger) of the results that
+    have one, as tab-separated lines
+    '''
+    return(''.join('%s\t%s\n' % (r.name, r.target_n_fraction) for r in results if r.target_n_fraction is not None))
+
+def write_gaps(path, results):
+    with open(path, 'w', buffering=1 << 20) as f:
+        f.write(format_gaps(results))
+
+def check_format(format):
+    '''
+    Exit if the packages a format needs are missing, so that a run can fail
+    before doing any work rather than when its output is opened
+    '''
+    if format == 'parquet':
+        try:
+            import pyarrow
+        except ImportError:
+            err('Writing parquet output requires the pyarrow package')
+
+def open_writer(path, format='tsv', jobs=1, gaps=None):
+    '''
+    Open a writer of the kept hits of results to path. If gaps is given, the
+    target N fraction of each gene is also written there (see GapWriter).
+    '''
+    if gaps is not None:
+        return(GapWriter(open_writer(path, format=format, jobs=jobs), gaps))
+    if format == 'tsv':
+        return(TsvWriter(path, jobs=jobs))
+    if format == 'columnar':
+        return(ColumnarWriter(path))
+    if format == 'parquet':
+        return(ParquetWriter(path))
+    err("Unknown output format '%s', choose from: %s" % (format, ', '.join(FORMATS)))
+
+class TsvWriter:
+    '''
+    Writes the kept hits of each result as tab-separated lines, through a
+    large buffer. Given a list of results and jobs > 1, the results are
+    formatted in chunks by forked workers and written in their input order.
+    '''
+    chunk_size = 2000
+
+    def __init__(self, path, jobs=1):
+        self._file = open(path, 'w', buffering=1 << 20)
+        self.jobs = jobs
+
+    def write(self, results):
+        if self.jobs > 1 and isinstance(results, list) and len(results) > self.chunk_size and can_fork():
+            self._write_parallel(results)
+            return
+        for result in results:
+            if result.hits:
+                self._file.write(format_results((result,)))
+
+    def _write_parallel(self, results):
+        chunks = range(0, len(results), self.chunk_size)
+        for text in fork_map(_format_chunk, (results, self.chunk_size), chunks, self.jobs):
+            self._file.write(text)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+class GapWriter:
+    '''
+    Passes results on to the writer of their hits, and writes the fraction of
+    the target between each gene's flanking blocks that is N to a separate
+    tab-separated file. A gene missing from the target where that fraction is
+    high may just fall in an assembly gap.
+    '''
+    def __init__(self, out, path):
+        self.out = out
+        self._file = open(path, 'w', buffering=1 << 20)
+
+    def write(self, results):
+        if isinstance(results, list):
+            self._file.write(format_gaps(results))
+            self.out.write(results)
+        else:
+            self.out.write(self._passing(results))
+
+    def _passing(self, results):
+        # results that are streamed are written as they go by
+        for result in results:
+            self._file.write(format_gaps((result,)))
+            yield result
+
+    def close(self):
+        self.out.close()
+        self._file.close()
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+def _format_chunk(shared, start):
+    '''
+    Format a chunk of results in a forked worker
+    '''
+    results, chunk_size = shared
+    return(format_results(results[start:start + chunk_size]))
+
+class ColumnarWriter:
+    '''
+    Collects the kept hits and writes them on close as one columnar file in
+    the layout of a hits cache (see lib.cache), so they can be memory-mapped
+    back with cache.load_results
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.hits = []
+
+    def write(self, results):
+        for result in results:
+            self.hits.extend(result.hits)
+
+    def close(self):
+        import lib.cache as cache
+        meta, columns = cache.hit_columns(self.hits)
+        cache.write(self.path, 'results', None, meta, columns)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args):
+        self.close()
+
+class ParquetWriter(ColumnarWriter):
+    '''
+    Writes the kept hits as a Parquet table, which requires pyarrow
+    '''
+    def __init__(self, path):
+        check_format('parquet')
+        super().__init__(path)
+
+    def close(self):
+        import pyarrow
+        import pyarrow.parquet
+        import lib.cache as cache
+        from lib.exonerate import IntronHit
+        names = ['gene', 'gene_start', 'gene_stop', 'target', 'target_start', 'target_stop', 'score']
+        if self.hits and isinstance(self.hits[0], IntronHit):
+            names += list(cache.INTRON_FIELDS)
+        columns = zip(*(h.fields() for h in self.hits)) if self.hits else [[] for _ in names]
+        table = pyarrow.table(dict(zip(names, map(list, columns))))
+        pyarrow.parquet.write_table(table, self.path)
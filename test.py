@@ -2,11 +2,36 @@
 
 import fagin
 import lib.intervals as intervals
+import lib.columnar as columnar
 import lib.genome as genome
 import lib.syn_merger as syn_merger
+import lib.hit_merger as hit_merger
 import lib.synteny as synteny
 import lib.result_manager as rMan
+import lib.exonerate as exonerate
+import lib.cache as cache
+import lib.compressed as compressed
+import lib.profiler as profiler
+import lib.util as util
+import lib.sweep as sweep
+import lib.writer as writer
+import lib.state as state
+import lib.nstrings as nstrings
+import lib.hit_analyzer as hit_analyzer
+import lib.contigs as contigs
+import lib.shared as shared
+import gzip
+import io
+import os
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
 import unittest
+import zlib
 
 class TestIntervals(unittest.TestCase):
     def setUp(self):
@@ -29,6 +54,18 @@ class TestIntervals(unittest.TestCase):
         self.assertTrue(intervals.overlaps( a, self.f))
         self.assertFalse(intervals.overlaps(a, self.g))
         self.assertFalse(intervals.overlaps(a, self.h))
+    def test_hash(self):
+        a = intervals.Interval(contig='a', start=1, stop=9)
+        g = genome.Gene(contig='a', start=1, stop=9, name='g')
+        self.assertEqual(len({a, g, self.a, self.b}), 2)
+    def test_slots(self):
+        objects = (
+            intervals.MappedInterval(contig='a', start=1, stop=2),
+            genome.Gene(contig='a', start=1, stop=2, name='g'),
+            exonerate.IntronHit(['g', '1', '9', '+', 't1', '10', '20', '+', '5', '0', '0', '0', '1', '50'])
+        )
+        for obj in objects:
+            self.assertFalse(hasattr(obj, '__dict__'))
     def test_allequal(self):
         self.assertTrue(intervals.allequal([1,1,1,1]))
         self.assertTrue(intervals.allequal(['a', 'a', 'a', 'a']))
@@ -117,6 +154,392 @@ class TestIntervalSet(unittest.TestCase):
     def test_get_overlapping_multiple(self):
         bound = intervals.Interval('c1', start=11, stop=13)
         self.assertTrue(set([x.name for x in self.intset.get_overlapping(bound)]) == {'b', 'c', 'd', 'e'})
+    def test_unlinked(self):
+        # plain Intervals have no slots for the links, so are left unlinked
+        plain = intervals.IntervalSet([intervals.Interval('a', 5, 9), intervals.Interval('a', 1, 3)])
+        first = plain.anchor(intervals.Interval('a', 1, 2))
+        self.assertEqual((first.start, list(intervals.get_following(first, 1))), (1, []))
+    def test_get_overlapping_nested(self):
+        # a short interval between two long ones must not stop the search
+        nested = intervals.IntervalSet((
+            genome.Gene(name='long1', contig='n', start=0,  stop=100),
+            genome.Gene(name='long2', contig='n', start=5,  stop=100),
+            genome.Gene(name='short', contig='n', start=10, stop=12),
+            genome.Gene(name='after', contig='n', start=20, stop=30)
+        ))
+        bound = intervals.Interval('n', start=50, stop=60)
+        self.assertTrue([x.name for x in nested.get_overlapping(bound)] == ['long1', 'long2'])
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_overlapping(self):
+        starts = [0, 0, 3, 4, 10, 11, 11, 15, 30, 31, 32, 40, 41, 60, 61, 62, 63, 70]
+        stops  = [5, 90, 3, 8, 12, 50, 11, 16, 31, 31, 33, 80, 42, 60, 62, 65, 63, 71]
+        index = intervals.IntervalIndex(starts, stops)
+        for start, stop in ((0, 0), (3, 3), (9, 9), (12, 35), (55, 61), (66, 69), (95, 99)):
+            expected = [i for i in range(len(starts)) if stops[i] >= start and starts[i] <= stop]
+            self.assertEqual(list(index.overlapping(start, stop)), expected)
+        self.assertEqual(index.first_overlapping(66, 69), 1)
+        self.assertEqual(intervals.IntervalIndex([], []).first_overlapping(1, 2), None)
+
+class TestColumnarIntervalSet(unittest.TestCase):
+    def setUp(self):
+        self.anchor_set = columnar.ColumnarIntervalSet.from_columns(
+            contigs = ['a', 'a', 'c', 'a', 'a', 'b', 'c'],
+            starts  = [ 50,  10,  15,  30,  70,   0,   5],
+            stops   = [ 60,  20,  20,  40,  80,   5,  10],
+            scores  = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
+        )
+        self.over_set = columnar.ColumnarIntervalSet.from_columns(
+            contigs = ['x', 'x', 'x', 'y', 'y', 'y', 'x'],
+            starts  = [  1,   2,   3,   4,   5,   6,   7],
+            stops   = [ 11,  12,  13,  14,  15,  16,  17]
+        )
+        columnar.ColumnarIntervalSet.pair(self.anchor_set, self.over_set)
+
+    def _bounds(self, blocks):
+        return([(x.contig, x.start, x.stop) for x in blocks])
+
+    def test_sorting(self):
+        self.assertEqual(
+            self._bounds(self.anchor_set.intervals()),
+            [('a', 10, 20), ('a', 30, 40), ('a', 50, 60), ('a', 70, 80),
+             ('b', 0, 5), ('c', 5, 10), ('c', 15, 20)]
+        )
+
+    def test_order(self):
+        a = self.anchor_set.anchor(intervals.Interval('a', 0, 5))
+        self.assertTrue(a.last == None)
+        self.assertEqual((a.next.start, a.next.next.start), (30, 50))
+        self.assertTrue(a.next.next.next.next == None)
+
+    def test_over(self):
+        a = self.anchor_set.anchor(intervals.Interval('a', 31, 32))
+        self.assertEqual((a.over.contig, a.over.start, a.over.score), ('y', 4, None))
+        self.assertEqual(a.score, 0.4)
+        self.assertTrue(a.over.over == a)
+
+    def test_anchor_for_overlap_cases(self):
+        a  = self.anchor_set.anchor(intervals.Interval('a',  0, 5  ))
+        b  = self.anchor_set.anchor(intervals.Interval('a', 21, 31 ))
+        d  = self.anchor_set.anchor(intervals.Interval('a', 75, 95 ))
+        c  = self.anchor_set.anchor(intervals.Interval('a', 61, 65 ))
+        dd = self.anchor_set.anchor(intervals.Interval('a', 66, 69 ))
+        self.assertEqual([x.start for x in (a, b, d, c, dd)], [10, 30, 70, 50, 70])
+
+    def test_anchor_several_overlapping(self):
+        # the block the linked set's binary search meets first, not the
+        # last block starting before the end of the query
+        two = columnar.ColumnarIntervalSet.from_columns(
+            contigs = ['t', 't'],
+            starts  = [1061888, 1065266],
+            stops   = [1064173, 1067589]
+        )
+        query = intervals.Interval('t', 1063706, 1065275)
+        self.assertEqual(two.anchor(query).start, 1061888)
+        self.assertEqual(two.anchor_many([query])[0].start, 1061888)
+
+        rng = random.Random(7)
+        starts = [rng.randrange(10000) for _ in range(300)]
+        stops = [x + rng.randrange(1, 400) for x in starts]
+        many = columnar.ColumnarIntervalSet.from_columns(['r'] * 300, starts, stops)
+        linked = intervals.IntervalSet(
+            genome.Gene(contig='r', start=a, stop=b, name=str(k)) for k, (a, b) in enumerate(zip(starts, stops)))
+        queries = [intervals.Interval('r', x, x + rng.randrange(1, 300)) for x in range(0, 10000, 37)]
+        batch = many.anchor_many(queries)
+        for query, anchor in zip(queries, batch):
+            expected = linked.anchor(query)
+            if intervals.overlaps(expected, query):
+                self.assertEqual(self._bounds([many.anchor(query), anchor]), self._bounds([expected, expected]))
+
+    def test_anchor_for_single_interval_contigs(self):
+        e = self.anchor_set.anchor(intervals.Interval('b', 90, 100))
+        self.assertEqual(self._bounds([e]), [('b', 0, 5)])
+
+    def test_anchor_missing_contig(self):
+        self.assertTrue(self.anchor_set.anchor(intervals.Interval('z', 1, 2)) is None)
+
+    def test_anchor_many(self):
+        queries = [
+            intervals.Interval('c', 21, 22),
+            intervals.Interval('a', 75, 95),
+            intervals.Interval('z',  1,  2),
+            intervals.Interval('a',  0,  5),
+            intervals.Interval('a', 61, 65)
+        ]
+        many = self.anchor_set.anchor_many(queries)
+        self.assertTrue(many[2] is None)
+        self.assertEqual(
+            self._bounds(x for x in many if x),
+            self._bounds(self.anchor_set.anchor(q) for q in queries if q.contig != 'z')
+        )
+
+    def test_get_overlapping(self):
+        bound = intervals.Interval('a', start=35, stop=55)
+        self.assertEqual(self._bounds(self.anchor_set.get_overlapping(bound)),
+                         [('a', 30, 40), ('a', 50, 60)])
+        bound = intervals.Interval('a', start=41, stop=49)
+        self.assertEqual(self.anchor_set.get_overlapping(bound), [])
+
+    def test_nested(self):
+        nested = columnar.ColumnarIntervalSet.from_columns(
+            contigs = ['n', 'n', 'n', 'n'],
+            starts  = [  0,   5,  10,  20],
+            stops   = [100, 100,  12,  30]
+        )
+        bound = intervals.Interval('n', start=50, stop=60)
+        self.assertEqual(self._bounds(nested.get_overlapping(bound)), [('n', 0, 100), ('n', 5, 100)])
+        self.assertTrue(intervals.overlaps(nested.anchor(bound), bound))
+
+class TestSynteny(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '# query and target blocks\n',
+            'q2\t50\t60\tt1\t500\t600\t0.5\t+\n',
+            'q1\t10\t20\tt2\t100\t200\t0.9\t+\n',
+            'q1\t30\t40\tt1\t300\t400\t1\t-\n',
+            'q1\t5\t8\tt1\t700\t800\t0.1\t+\n'
+        ]
+
+    def _blocks(self, iset):
+        return([(contigs.name(x.contig), x.start, x.stop, contigs.name(x.over.contig), x.over.start, x.score)
+                for x in iset.intervals()])
+
+    def test_chunked_load(self):
+        class SmallChunks(synteny.Synteny):
+            chunk_size = 2
+        whole = synteny.Synteny(self.lines)
+        chunked = SmallChunks(self.lines)
+        self.assertEqual(self._blocks(whole.query), self._blocks(chunked.query))
+        self.assertEqual(self._blocks(whole.target), self._blocks(chunked.target))
+        self.assertEqual(self._blocks(whole.query), [
+            ('q1',  5,  8, 't1', 700, 0.1),
+            ('q1', 10, 20, 't2', 100, 0.9),
+            ('q1', 30, 40, 't1', 300, 1.0),
+            ('q2', 50, 60, 't1', 500, 0.5)
+        ])
+
+    def test_bulk_load(self):
+        text = ''.join(self.lines)
+        blocks = list(util.read_blocks(io.StringIO(text), size=10))
+        self.assertEqual(''.join(blocks), text)
+        self.assertTrue(all(b.endswith('\n') for b in blocks))
+        whole = self._blocks(synteny.Synteny(self.lines).query)
+        # without comments the blocks are split at once
+        self.assertEqual(self._blocks(synteny.Synteny(io.StringIO(''.join(self.lines[1:]))).query), whole)
+        self.assertEqual(self._blocks(synteny.Synteny(io.StringIO(text)).query), whole)
+        self.assertEqual(self._blocks(synteny.Synteny(rows=[x.split() for x in self.lines[1:]]).query), whole)
+
+    def test_cut_low_score_pairs(self):
+        syn = synteny.Synteny(self.lines)
+        syn.cut_low_score_pairs(0.5)
+        kept = synteny.Synteny([x for x in self.lines[1:] if float(x.split()[6]) >= 0.5])
+        loaded = synteny.Synteny(self.lines, min_score=0.5)
+        for side in ('query', 'target'):
+            self.assertEqual(self._blocks(getattr(syn, side)), self._blocks(getattr(kept, side)))
+            self.assertEqual(self._blocks(getattr(loaded, side)), self._blocks(getattr(kept, side)))
+            self.assertEqual(len(getattr(syn, side)), 3)
+        # the dropped block is gone from lookups on both sides
+        self.assertEqual(syn.anchor_query(intervals.Interval(contigs.intern('q1'), 5, 8)).start, 10)
+        self.assertEqual(syn.anchor_target(intervals.Interval(contigs.intern('t1'), 700, 800)).start, 500)
+        self.assertEqual([syn.query.block(r).over.row for r in range(3)], [0, 1, 2])
+        syn.cut_low_score_pairs(2)
+        self.assertEqual((len(syn.query), list(syn.query.contigs)), (0, []))
+
+    def test_anchor_targets(self):
+        syn = synteny.Synteny(self.lines)
+        targets = [intervals.Interval(contigs.intern(c), a, b) for c, a, b in
+                   (('t1', 0, 10), ('t2', 150, 160), ('t3', 1, 2), ('t1', 450, 460), ('t1', 900, 950),
+                    ('t1', 350, 360))]
+        anchors = [syn.anchor_target(x) for x in targets]
+        expected = [(None, 0, 0) if a is None else (a.contig, a.start, a.stop) for a in anchors]
+        self.assertEqual(list(zip(*syn.anchor_targets(targets))), expected)
+        self.assertEqual(syn.anchor_targets([]), ([], [], []))
+
+    def test_bad_rows(self):
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(self.lines + ['q1\t1\t2\tt1\t1\t2\t0.5\n'])
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(io.StringIO(''.join(self.lines[1:]) + 'q1\t1\t2\tt1\t1\t2\t0.5\n'))
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(self.lines + ['q1\t1\tx\tt1\t1\t2\t0.5\t+\n'])
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(self.lines + ['q1\t1\t2\tt1\t1\t2\t1.5\t+\n'])
+        # a short row and a long one hold as many fields as two good rows
+        ragged = ['q1\t1\t2\tt1\t1\t2\t0.5\n', 'q1\t1\t2\tt1\t1\t2\t0.5\t+\tx\n']
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(self.lines + ragged)
+        with self.assertRaises(SystemExit):
+            synteny.Synteny(io.StringIO(''.join(self.lines + ragged)))
+
+def bgzip(data, size):
+    blocks = []
+    for i in list(range(0, len(data), size)) + [len(data)]:
+        chunk = data[i:i + size]
+        deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+        body = deflate.compress(chunk) + deflate.flush()
+        head = b'\x1f\x8b\x08\x04' + bytes(4) + b'\x00\xff' + struct.pack('<HBBHH', 6, 66, 67, 2, len(body) + 25)
+        blocks.append(head + body + struct.pack('<II', zlib.crc32(chunk), len(chunk)))
+    return(b''.join(blocks))
+
+class TestCompressed(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.text = ''.join('q%d\t%d\t%d\tt1\t%d\t%d\t0.5\t+\n' % (i % 3, i, i + 5, i, i + 5) for i in range(500))
+        self.paths = {}
+        data = self.text.encode()
+        for kind, packed in (('plain', data), ('gzip', gzip.compress(data)), ('bgzip', bgzip(data, 1000))):
+            self.paths[kind] = os.path.join(self.tmp.name, kind)
+            with open(self.paths[kind], 'wb') as f:
+                f.write(packed)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_read(self):
+        for kind, path in self.paths.items():
+            with compressed.open_input(path) as f:
+                self.assertEqual(f.read(), self.text, kind)
+                self.assertEqual(f.name, path)
+
+    def test_bgzip_seek(self):
+        with compressed.open_input(self.paths['bgzip'], threads=2) as f:
+            f.readline()
+            pos = f.tell()
+            line = f.readline()
+            f.read()
+            f.seek(pos)
+            self.assertEqual(f.readline(), line)
+
+    def test_synteny(self):
+        blocks = lambda s: [(x.contig, x.start, x.over.start) for x in s.query.intervals()]
+        with compressed.open_input(self.paths['plain']) as f:
+            expected = blocks(synteny.Synteny(f))
+        for kind in ('gzip', 'bgzip'):
+            with compressed.open_input(self.paths[kind]) as f:
+                self.assertEqual(blocks(synteny.Synteny(f)), expected)
+
+class TestContigs(unittest.TestCase):
+    def test_intern(self):
+        table = contigs.Contigs()
+        self.assertEqual(list(table.intern_all(['z', 'a', 'z', 'm'])), [0, 1, 0, 2])
+        self.assertEqual((table.intern('a'), table.intern('b'), table.name(3)), (1, 3, 'b'))
+
+    def test_shared(self):
+        # IDs are shared across loaders, but genes are still ordered by name
+        syn = synteny.Synteny(['ctg_z\t1\t2\tctg_y\t1\t2\t1\t+\n'])
+        gen = genome.Genome(['ctg_y\t.\tgene\t1\t2\t.\t+\t.\tb\n', 'ctg_x\t.\tgene\t1\t2\t.\t+\t.\ta\n'])
+        hit = exonerate.Hit(['a', '1', '2', '+', 'ctg_y', '1', '2', '+', '1'])
+        self.assertEqual(hit.target.contig, syn.target.block(0).contig)
+        self.assertEqual([g.name for g in gen.intervals()], ['a', 'b'])
+        self.assertEqual(str(gen).split('\n')[1], 'b\tctg_y\t1\t2')
+        # the gene of a hit is not interned
+        self.assertEqual((str(hit.gene), str(hit.target)), ('a\t1\t2', 'ctg_y\t1\t2'))
+        self.assertEqual(str(intervals.Interval('a', 1, 2)), 'a\t1\t2')
+
+class TestNStrings(unittest.TestCase):
+    def test_count(self):
+        rng = random.Random(1)
+        rows = [('c%d\t%d\t%d\n' % (rng.randrange(2), rng.randrange(1000), rng.randrange(40))) for _ in range(60)]
+        nstr = nstrings.NStrings(rows)
+        ns = {c: set() for c in ('c0', 'c1')}
+        for row in rows:
+            c, start, length = row.split()
+            ns[c].update(range(int(start), int(start) + int(length)))
+        queries = [intervals.Interval(contigs.intern('c%d' % rng.randrange(3)), a, a + rng.randrange(200))
+                   for a in (rng.randrange(1100) for _ in range(300))]
+        expected = [len(ns.get(contigs.name(q.contig), set()) & set(range(q.start, q.stop + 1))) / (q.stop - q.start + 1)
+                    for q in queries]
+        self.assertEqual(list(nstr.fractions(queries)), expected)
+        self.assertEqual(nstr.count(contigs.intern('c0'), 0, 2000), len(ns['c0']))
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp.name, 'cache')
+        self.files = {
+            'synteny' : ('q1\t10\t20\tt1\t10\t20\t0.5\t+\n'
+                         'q2\t30\t40\tt1\t50\t60\t1\t+\n'
+                         'q1\t50\t60\tt2\t50\t60\t0.2\t-\n'),
+            'genome'  : ('q1\t.\tgene\t15\t25\t.\t+\t.\tg1\n'
+                         'q1\t.\tgene\t5\t8\t.\t+\t.\tg2\n'),
+            'hits'    : ('\t'.join('abcdefghijklmn') + '\n' +
+                         'g1\t1\t9\t+\tt1\t10\t19\t+\t42.5\t0\t1\t2\t3\t4\n'
+                         'g2\t2\t8\t+\tt2\t30\t39\t+\t12\t5\t6\t7\t8\t9\n')
+        }
+        for kind, text in self.files.items():
+            with open(self._path(kind), 'w') as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _path(self, kind):
+        return(os.path.join(self.tmp.name, kind + '.txt'))
+
+    def _load(self, kind, build=False):
+        with open(self._path(kind)) as f:
+            if build:
+                cache.build(f, kind, self.cache_dir)
+                f.seek(0)
+            return(cache.load(f, kind, self.cache_dir))
+
+    def _summary(self, kind, obj):
+        if kind == 'synteny':
+            return([(x.contig, x.start, x.stop, x.over.contig, x.over.start, x.score) for x in obj.query.intervals()])
+        elif kind == 'genome':
+            return([(g.name, g.contig, g.start, g.stop) for g in obj.intervals()])
+        else:
+            return([str(h) for h in obj.generator()])
+
+    def _is_cached(self, obj):
+        return(isinstance(next(iter(obj.query.contigs.values())).starts, memoryview))
+
+    def test_round_trip(self):
+        for kind in ('synteny', 'genome'):
+            parsed = self._summary(kind, self._load(kind))
+            self._load(kind, build=True)
+            self.assertEqual(self._summary(kind, self._load(kind)), parsed)
+
+        # hits are parsed lazily, so read them while the file is open
+        with open(self._path('hits')) as f:
+            parsed = self._summary('hits', cache.load(f, 'hits', self.cache_dir))
+            f.seek(0)
+            cache.build(f, 'hits', self.cache_dir)
+        with open(self._path('hits')) as f:
+            cached = cache.load(f, 'hits', self.cache_dir)
+        self.assertEqual(self._summary('hits', cached), parsed)
+
+    def test_invalidation(self):
+        self._load('synteny', build=True)
+        self.assertTrue(self._is_cached(self._load('synteny')))
+
+        # a new mtime alone does not invalidate the cache
+        os.utime(self._path('synteny'), ns=(0, 0))
+        self.assertTrue(self._is_cached(self._load('synteny')))
+
+        # changed content does
+        with open(self._path('synteny'), 'a') as f:
+            f.write('q3\t1\t2\tt3\t1\t2\t1\t+\n')
+        syn = self._load('synteny')
+        self.assertFalse(self._is_cached(syn))
+        self.assertTrue(contigs.intern('q3') in syn.query.contigs)
+
+    def test_shared(self):
+        name = 'test-%d' % os.getpid()
+        syn = self._load('synteny')
+        syn.cut_low_score_pairs(0.5)
+        shared.publish(syn, name)
+        try:
+            with self.assertRaises(SystemExit):
+                shared.publish(syn, name)
+            attached = shared.attach(name)
+            self.assertTrue(self._is_cached(attached))
+            self.assertEqual(self._summary('synteny', attached), self._summary('synteny', syn))
+            self.assertEqual(attached.min_score, 0.5)
+        finally:
+            shared.withdraw(name)
+        with self.assertRaises(SystemExit):
+            shared.attach(name)
 
 class TestContext(unittest.TestCase):
     def setUp(self):
@@ -133,8 +556,8 @@ class TestContext(unittest.TestCase):
             ('q1', 100, 180, 'c1', 30, 40, 1, '+'),
             ('q1',  50,  60, 'c1', 50, 60, 1, '+')
         ))
-        self.missing_gene = genome.Gene(contig='q1', start=30, stop=40, name='missing')
-        self.present_gene = genome.Gene(contig='q1', start=15, stop=25, name='present')
+        self.missing_gene = genome.Gene(contig=contigs.intern('q1'), start=30, stop=40, name='missing')
+        self.present_gene = genome.Gene(contig=contigs.intern('q1'), start=15, stop=25, name='present')
 
     def _get_result(self, gene, syn, width=1):
         synmer = syn_merger.SynMerger(width)
@@ -160,6 +583,27 @@ class TestContext(unittest.TestCase):
         self.assertTrue(result.upper)
         self.assertFalse(result.lower)
 
+    def test_merge_all_matches_merge(self):
+        q1, q9 = contigs.intern('q1'), contigs.intern('q9')
+        genes = [genome.Gene(contig=q1, start=x, stop=x + 10, name=str(x)) for x in range(0, 200, 7)]
+        genes.append(genome.Gene(contig=q9, start=1, stop=2, name='elsewhere'))
+        state = lambda r: (r.is_present, r.is_simple, str(r.lower), str(r.upper), r.links, r.context)
+        for syn in (self.syn_simple, self.syn_not_simple, self.syn_not_simple_insertion):
+            for width in (1, 2):
+                single = [self._get_result(g, syn, width) for g in genes]
+                batch = [rMan.Result(gene=g) for g in genes]
+                syn_merger.SynMerger(width).merge_all(results=reversed(batch), syn=syn)
+                self.assertEqual([state(r) for r in batch], [state(r) for r in single])
+
+    def test_ranges(self):
+        result = self._get_result(self.present_gene, self.syn_not_simple_insertion, width=2)
+        self.assertEqual((result.links, result.context, result.upper.index), ((0, 1), (0, 3), 1))
+        result = self._get_result(self.missing_gene, self.syn_not_simple_insertion)
+        self.assertEqual((result.links, result.context), ((1, 1), (0, 2)))
+        hitmer = hit_merger.HitMerger(flank_width=45, min_neighbors=1, target_flank_ratio=1)
+        result.query_flanks = intervals.Interval(contigs.intern('q1'), 0, 85)
+        self.assertEqual(hitmer._get_flank_ranges(result), ((0, 1), (1, 2)))
+
     def test_is_simple(self):
         result = self._get_result(self.present_gene, self.syn_simple)
         self.assertTrue(result.is_simple)
@@ -173,6 +617,316 @@ class TestContext(unittest.TestCase):
         result = self._get_result(self.missing_gene, self.syn_not_simple_insertion)
         self.assertFalse(result.is_simple)
 
+class TestHitMerger(unittest.TestCase):
+    def test_flank_targets(self):
+        blocks = [intervals.MappedInterval(contig='q', start=i, stop=i + 1) for i in range(5)]
+        targets = [('t1', 10, 20), ('t1', 15, 40), ('t1', 50, 60), ('t2', 10, 20), ('t1', 0, 5)]
+        for block, (contig, start, stop) in zip(blocks, targets):
+            block.over = intervals.Interval(contig, start, stop)
+        flanks = hit_merger.FlankTargets(blocks)
+        for bound in (('t1', 18, 30), ('t1', 5, 9), ('t1', 41, 49), ('t1', 0, 100), ('t2', 20, 20), ('t3', 0, 9)):
+            bound = intervals.Interval(*bound)
+            expected = sum(intervals.overlaps(bound, b.over) for b in blocks)
+            self.assertEqual(flanks.count_overlapping(bound), expected)
+
+    def test_merge_all_matches_merge(self):
+        syn = synteny.Synteny(rows = [
+            ('q1', 100 * i, 100 * i + 50, 't1' if i % 4 else 't2', 100 * i, 100 * i + 50, 1, '+') for i in range(30)
+        ])
+        gene = genome.Gene(contig=contigs.intern('q1'), start=1510, stop=1520, name='g')
+        hits = []
+        for tstart in (0, 1500, 1500, 2900, 1200, 1500):
+            row = ['g', '1', '9', '+', 't1', str(tstart), str(tstart + 5), '+', str(tstart % 7)]
+            hits.append(exonerate.Hit(row))
+        synmer = syn_merger.SynMerger(2)
+        hitmer = hit_merger.HitMerger(flank_width=600, min_neighbors=4, target_flank_ratio=1, quiet=True)
+
+        batched = rMan.Result(gene=gene)
+        synmer.merge(result=batched, syn=syn)
+        hitmer.merge_all(result=batched, hits=hits, syn=syn)
+
+        single = rMan.Result(gene=gene)
+        synmer.merge(result=single, syn=syn)
+        for hit in hits:
+            hitmer.merge(result=single, hit=hit, syn=syn)
+
+        self.assertEqual(batched.total_hits, 6)
+        self.assertEqual([h.target.start for h in batched.hits], [1500, 1200])
+        self.assertEqual(str(batched), str(single))
+
+    def test_hit_hash(self):
+        row = ['g', '1', '9', '+', 't1', '10', '20', '+', '5']
+        self.assertEqual(len({exonerate.Hit(row), exonerate.Hit(list(row)), exonerate.Hit(row[:8] + ['6'])}), 2)
+
+class TestExonerate(unittest.TestCase):
+    def setUp(self):
+        self.header = '\t'.join('abcdefgh') + '\n'
+        self.rows = ['%s\t1\t9\t+\tt1\t%d\t%d\t+\t5\n' % (name, i, i + 5)
+                     for i, name in enumerate('bbacaab')]
+
+    def _groups(self, exo, **kwargs):
+        return([[(h.name, h.target.start) for h in g] for g in exo.grouped(**kwargs)])
+
+    def test_grouped_input(self):
+        rows = sorted(self.rows, key=lambda x: x[0])
+        with tempfile.TemporaryFile('w+') as f:
+            f.write(self.header + ''.join(rows))
+            f.seek(0)
+            exo = exonerate.Exonerate(f)
+            self.assertTrue(exo._is_grouped())
+            self.assertEqual(self._groups(exo), [
+                [('a', 2), ('a', 4), ('a', 5)],
+                [('b', 0), ('b', 1), ('b', 6)],
+                [('c', 3)]
+            ])
+
+    def test_ungrouped_input(self):
+        expected = [[('a', 2), ('a', 4), ('a', 5)], [('b', 0), ('b', 1), ('b', 6)], [('c', 3)]]
+        with tempfile.TemporaryFile('w+') as f:
+            f.write(self.header + ''.join(self.rows))
+            f.seek(0)
+            exo = exonerate.Exonerate(f)
+            self.assertFalse(exo._is_grouped())
+            self.assertEqual(self._groups(exo, chunk_size=2), expected)
+        # a pipe can't be rewound, so it is always sorted
+        exo = exonerate.Exonerate(iter([self.header] + self.rows))
+        self.assertEqual(self._groups(exo), expected)
+
+    def test_spaces(self):
+        # fields are split on tabs only, so a target name may hold a space
+        rows = ['a\t1\t9\t+\tt 1\t%d\t%d\t+\t5\n' % (i, i + 5) for i in range(3)]
+        with tempfile.TemporaryFile('w+') as f:
+            f.write(self.header + ''.join(rows))
+            f.seek(0)
+            hits = list(exonerate.Exonerate(f).generator())
+        self.assertEqual([str(h) for h in hits], ['a\t1\t9\tt 1\t%d\t%d\t5.0' % (i, i + 5) for i in range(3)])
+
+class TestHitAnalyzer(unittest.TestCase):
+    def test_filter(self):
+        # score, first_stop, has_frameshift, max_intron for hits aligning query 1-90
+        fields = [(50, 0, 0, 100), (5, 0, 0, 100), (50, 40, 0, 100), (50, 90, 0, 100),
+                  (50, 0, 1, 100), (50, 0, 0, 5000)]
+        results = []
+        for name in ('a', 'b'):
+            result = rMan.Result(genome.Gene(name=name, contig='q', start=1, stop=90))
+            result.hits = [exonerate.IntronHit([name, '1', '90', '+', 't', str(i), str(i + 5), '+', str(score),
+                                                str(stop), str(frameshift), '0', '1', str(intron)])
+                           for i, (score, stop, frameshift, intron) in enumerate(fields)]
+            results.append(result)
+        prof = profiler.Profiler()
+        analyzer = hit_analyzer.HitAnalyzer(min_score=10, no_frameshift=True, no_premature_stop=True,
+                                            max_intron=1000, profiler=prof)
+        analyzer.filter(results)
+        for result in results:
+            self.assertEqual([h.target.start for h in result.hits], [0, 3])
+            self.assertEqual(result.hit_set, set(result.hits))
+        counts = prof.report()['counters']
+        self.assertEqual(counts['hits filtered'], 8)
+        self.assertEqual(counts['hits failing no_premature_stop'], 2)
+        # no rules keep everything
+        hit_analyzer.HitAnalyzer().filter(results)
+        self.assertEqual(len(results[0].hits), 2)
+
+class TestResultManager(unittest.TestCase):
+    def setUp(self):
+        self.syn = []
+        self.gff = []
+        self.hits = ['\t'.join('abcdefgh') + '\n']
+        for q in range(3):
+            for b in range(40):
+                start = 100 * b
+                self.syn.append('q%d\t%d\t%d\tt%d\t%d\t%d\t1\t+\n' % (q, start, start + 50, q, start, start + 50))
+            for g in range(5):
+                start = 700 * g + 60
+                name = 'g%d_%d' % (q, g)
+                self.gff.append('q%d\t.\tgene\t%d\t%d\t.\t+\t.\t%s\n' % (q, start, start + 20, name))
+                for t, tstart in ((q, start), (q, start + 10), ((q + 1) % 3, start), (q, 9000)):
+                    self.hits.append('%s\t1\t9\t+\tt%d\t%d\t%d\t+\t%d\n' % (name, t, tstart, tstart + 5, g))
+
+    def _run(self, prof=None, hits=None, flank_width=300, min_neighbors=2, gaps=None, rows=True, **kwargs):
+        manager = rMan.ResultManager(
+            gen          = genome.Genome(self.gff),
+            syn          = synteny.Synteny(self.syn),
+            exo          = exonerate.Exonerate(iter(self.hits if hits is None else hits)),
+            syn_merger   = syn_merger.SynMerger(width=2, profiler=prof, nstrings=gaps and nstrings.NStrings(gaps)),
+            hit_merger   = hit_merger.HitMerger(flank_width=flank_width, min_neighbors=min_neighbors, target_flank_ratio=2,
+                                                quiet=True, profiler=prof, nstrings=gaps and nstrings.NStrings(gaps)),
+            hit_analyzer = None,
+            profiler     = prof,
+            **kwargs
+        )
+        if not rows:
+            return(manager)
+        return([(r.name, r.is_present, r.is_simple, str(r.lower), str(r.upper), r.total_hits, str(r))
+                for r in manager.results.values()])
+
+    def test_streaming_matches_serial(self):
+        serial = {r[0]: r[6] for r in self._run() if r[6]}
+        for hits in (self.hits, self.hits[:1] + sorted(self.hits[1:])):
+            manager = rMan.StreamingResultManager(
+                gen          = genome.Genome(self.gff),
+                syn          = synteny.Synteny(self.syn),
+                exo          = exonerate.Exonerate(iter(hits)),
+                syn_merger   = syn_merger.SynMerger(width=2),
+                hit_merger   = hit_merger.HitMerger(flank_width=300, min_neighbors=2, target_flank_ratio=2, quiet=True),
+                hit_analyzer = None
+            )
+            streamed = {r.name: str(r) for r in manager.results() if str(r)}
+            self.assertEqual(streamed, serial)
+
+    def test_parallel_matches_serial(self):
+        serial = self._run()
+        self.assertEqual(self._run(jobs=3), serial)
+        self.assertTrue(all(r[5] == 4 for r in serial))
+        self.assertTrue(any(r[6] for r in serial))
+
+    def test_sweep_matches_runs(self):
+        defaults = {'hit-flank-width': 300, 'hit-min-neighbors': 2, 'hit-target-flank-ratio': 2, 'syn-context-width': 2}
+        grid = sweep.parse_grid(['hit-flank-width=100,300', 'hit-min-neighbors=1,3'], defaults)
+        self.assertEqual(len(sweep.combinations(grid)), 4)
+        sweeper = sweep.Sweep(
+            gen  = genome.Genome(self.gff),
+            syn  = synteny.Synteny(self.syn),
+            exo  = exonerate.Exonerate(iter(self.hits)),
+            grid = grid,
+            jobs = 2
+        )
+        for params in sweep.combinations(grid):
+            manager = self._run(flank_width=params['hit-flank-width'], min_neighbors=params['hit-min-neighbors'], rows=False)
+            expected = [(r.name, r.is_simple, str(r)) for r in manager.results.values()]
+            self.assertEqual([(r.name, r.is_simple, str(r)) for r in sweeper.results(params)], expected)
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = sweeper.write(tmp)
+            self.assertEqual(sorted(os.listdir(tmp)), sorted(os.path.basename(p) for p in paths))
+            self.assertIn('w300_b3_r2.0_c2.tsv', os.listdir(tmp))
+        # a default gives the same name as the same value in the grid
+        names = lambda items: [sweep.filename(p) for p in sweep.combinations(sweep.parse_grid(items, defaults))]
+        self.assertEqual(names([]), names(['hit-target-flank-ratio=2']))
+
+    def test_write(self):
+        manager = self._run(rows=False)
+        expected = ''.join(str(r) + '\n' for r in manager.results.values() if r.hits)
+        kept = [h for r in manager.results.values() for h in r.hits]
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv = os.path.join(tmp, 'hits.tsv')
+            with writer.open_writer(tsv) as out:
+                manager.write(out)
+            with open(tsv) as f:
+                self.assertEqual(f.read(), expected)
+            # format in forked workers, a few results per chunk
+            parallel = writer.TsvWriter(tsv, jobs=3)
+            parallel.chunk_size = 2
+            with parallel:
+                manager.write(parallel)
+            with open(tsv) as f:
+                self.assertEqual(f.read(), expected)
+            fidx = os.path.join(tmp, 'hits.fidx')
+            with writer.open_writer(fidx, format='columnar') as out:
+                manager.write(out)
+            self.assertEqual([str(h) for h in cache.load_results(fidx).generator()], [str(h) for h in kept])
+
+    def test_reuse(self):
+        # drop one hit of g0_1 and add a hit to g2_4
+        changed = [h for h in self.hits if not h.startswith('g0_1\t1\t9\t+\tt0')]
+        changed.append('g2_4\t1\t9\t+\tt2\t2870\t2875\t+\t4\n')
+        expected = self._run(hits=changed, keep_state=True, rows=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            self._run(jobs=2, keep_state=True, rows=False).state.write(tmp, {'genome': None, 'synteny': None})
+            prof = profiler.Profiler()
+            reused = self._run(prof, hits=changed, reuse=state.State.load(tmp), keep_state=True, rows=False)
+        self.assertEqual(prof.report()['counters']['genes with reused hits'], 13)
+        fields = lambda r: (r.is_present, r.is_simple, str(r.lower), str(r.upper), r.links, r.context,
+                            r.flank_ranges, r.total_hits, str(r))
+        for name, result in expected.results.items():
+            self.assertEqual(fields(reused.results[name]), fields(result))
+        self.assertEqual(reused.state.columns, expected.state.columns)
+
+    def test_nstrings(self):
+        # gaps over all hits on t1 but the last base of each
+        gaps = ['t1\t%d\t5\n' % (700 * g + 60 + d) for g in range(5) for d in (0, 10)]
+        prof = profiler.Profiler()
+        manager = self._run(prof, gaps=gaps, rows=False)
+        self.assertEqual(prof.report()['counters']['hits in target gaps'], 15)
+        self.assertFalse(any(h.target.contig == contigs.intern('t1') for r in manager.results.values() for h in r.hits))
+        fractions = {r.name: r.target_n_fraction for r in manager.results.values()}
+        self.assertEqual(fractions['g0_0'], 0.0)
+        self.assertEqual(fractions['g1_1'], 10 / 49)
+        # and written next to the hits, for streamed results too
+        with tempfile.TemporaryDirectory() as tmp:
+            tsv, gaps = os.path.join(tmp, 'hits.tsv'), os.path.join(tmp, writer.GAPS)
+            with writer.open_writer(tsv, gaps=gaps) as out:
+                out.write(iter(manager.results.values()))
+            with open(gaps) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(len(lines), sum(n is not None for n in fractions.values()))
+        self.assertIn('g1_1\t%s' % (10 / 49), lines)
+
+    def test_profile(self):
+        serial, parallel = profiler.Profiler(), profiler.Profiler()
+        results = self._run(prof=serial)
+        self._run(prof=parallel, jobs=3)
+        counts = serial.report()['counters']
+        self.assertEqual(parallel.report()['counters'], counts)
+        self.assertEqual(parallel.report()['per_gene'], serial.report()['per_gene'])
+        self.assertEqual(counts['genes'], 15)
+        self.assertEqual(counts['hits'], 60)
+        self.assertEqual(counts['hits kept'], sum(str(r[6]).count('\n') + 1 for r in results if r[6]))
+        self.assertEqual(list(serial.stages), ['SynMerger', 'HitMerger'])
+        self.assertEqual(list(parallel.stages), ['parallel merge'])
+
+class TestStartup(unittest.TestCase):
+    # seconds allowed for fagin to start, and to run on trivial inputs
+    budget = 1.0
+
+    def _fagin(self, *args, output_dir=None):
+        '''
+        The last run and the best time of a few runs of fagin.py, from an
+        empty output_dir if one is given
+        '''
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fagin.py')] + list(args)
+        best = None
+        for _ in range(3):
+            if output_dir is not None:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            start = time.perf_counter()
+            proc = subprocess.run(cmd, capture_output=True, text=True, check=True)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        return(proc, best)
+
+    def test_version(self):
+        proc, seconds = self._fagin('--version')
+        self.assertIn(fagin.__version__, proc.stdout)
+        self.assertLess(seconds, self.budget)
+        # none of the modules of the run modes are imported
+        cmd = [sys.executable, '-X', 'importtime', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fagin.py'),
+               '--version']
+        lines = subprocess.run(cmd, capture_output=True, text=True).stderr.splitlines()
+        # the last column holds the module, indented by how deeply it is nested
+        imported = {line.rsplit('|', 1)[1].strip() for line in lines if line.startswith('import time:')}
+        self.assertIn('lib.util', imported)
+        for module in ('lib.cache', 'lib.result_manager', 'multiprocessing'):
+            self.assertNotIn(module, imported)
+
+    def test_trivial_run(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = {
+                'syn' : 'q1\t10\t20\tt1\t10\t20\t0.5\t+\nq1\t30\t40\tt1\t30\t40\t0.5\t+\n',
+                'gen' : 'q1\t.\tgene\t15\t25\t.\t+\t.\tg1\n',
+                'hit' : '\t'.join('abcdefgh') + '\ng1\t1\t9\t+\tt1\t10\t19\t+\t42.5\n'
+            }
+            for name, text in files.items():
+                with open(os.path.join(tmp, name), 'w') as f:
+                    f.write(text)
+            out = os.path.join(tmp, 'out')
+            proc, seconds = self._fagin(
+                '-g', os.path.join(tmp, 'gen'), '-s', os.path.join(tmp, 'syn'), '-t', os.path.join(tmp, 'hit'),
+                '-b', '1', '-o', out, '--cache-dir', os.path.join(tmp, 'cache'), '--print-startup-time',
+                output_dir=out)
+            self.assertTrue(proc.stderr.startswith('startup: '))
+            with open(os.path.join(out, 'hits.tsv')) as f:
+                self.assertEqual(f.read(), 'g1\t1\t9\tt1\t10\t19\t42.5\n')
+            self.assertLess(seconds, self.budget)
 
 if __name__ == '__main__':
     unittest.main()